@@ -0,0 +1,3 @@
+-- Web rendition and poster thumbnail produced by reflects.media after upload
+ALTER TABLE reflections ADD COLUMN IF NOT EXISTS web_video_url TEXT;
+ALTER TABLE reflections ADD COLUMN IF NOT EXISTS thumbnail_url TEXT;
@@ -0,0 +1,7 @@
+-- Reference counts for content-addressed video objects (videos/<sha256>)
+CREATE TABLE IF NOT EXISTS media_objects (
+    object_key TEXT PRIMARY KEY,
+    ref_count INTEGER NOT NULL DEFAULT 0 CHECK (ref_count >= 0),
+    size_bytes BIGINT,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
@@ -0,0 +1,42 @@
+-- Full-text search over reflection summaries (weight A) and feedback comments (weight B)
+ALTER TABLE reflections ADD COLUMN IF NOT EXISTS search_vector tsvector;
+
+CREATE OR REPLACE FUNCTION reflections_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('english', COALESCE(NEW.text_summary, '')), 'A') ||
+        setweight(to_tsvector('english', COALESCE(
+            (SELECT f.comment FROM feedback f
+             WHERE f.reflection_id = NEW.id AND f.obsolete = FALSE), '')), 'B');
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS reflections_search_vector_trg ON reflections;
+CREATE TRIGGER reflections_search_vector_trg
+    BEFORE INSERT OR UPDATE OF text_summary ON reflections
+    FOR EACH ROW EXECUTE FUNCTION reflections_search_vector_update();
+
+-- Feedback changes re-run the reflection trigger by touching text_summary
+CREATE OR REPLACE FUNCTION feedback_search_vector_refresh() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE reflections SET text_summary = text_summary WHERE id = OLD.reflection_id;
+    END IF;
+    IF TG_OP = 'INSERT' THEN
+        UPDATE reflections SET text_summary = text_summary WHERE id = NEW.reflection_id;
+    ELSIF TG_OP = 'UPDATE' AND NEW.reflection_id <> OLD.reflection_id THEN
+        UPDATE reflections SET text_summary = text_summary WHERE id = NEW.reflection_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS feedback_search_vector_trg ON feedback;
+CREATE TRIGGER feedback_search_vector_trg
+    AFTER INSERT OR UPDATE OF comment, obsolete, reflection_id OR DELETE ON feedback
+    FOR EACH ROW EXECUTE FUNCTION feedback_search_vector_refresh();
+
+-- Backfill existing rows, then index
+UPDATE reflections SET text_summary = text_summary;
+CREATE INDEX IF NOT EXISTS reflections_search_vector_idx ON reflections USING GIN (search_vector);
@@ -0,0 +1,2 @@
+-- Lets POST /subjects create-or-revive with a single INSERT ... ON CONFLICT (name)
+CREATE UNIQUE INDEX IF NOT EXISTS subjects_name_key ON subjects (name);
@@ -0,0 +1,2 @@
+-- Failed transcodes are retried by the media backfill up to TRANSCODE_MAX_ATTEMPTS times
+ALTER TABLE reflections ADD COLUMN IF NOT EXISTS transcode_attempts INTEGER NOT NULL DEFAULT 0;
@@ -0,0 +1,2 @@
+-- Content type recorded at upload; content-addressed keys have no extension to guess it from
+ALTER TABLE media_objects ADD COLUMN IF NOT EXISTS content_type TEXT;
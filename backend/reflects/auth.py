@@ -1,10 +1,9 @@
 from datetime import datetime, timedelta
+from functools import lru_cache
 from typing import Optional
 
 from fastapi import HTTPException, Depends, status
 from fastapi.security import OAuth2PasswordBearer
-from jose import JWTError, jwt
-from passlib.context import CryptContext
 from dotenv import load_dotenv
 import os
 
@@ -19,21 +18,26 @@ ACCESS_TOKEN_EXPIRE_MINUTES: int = 60
 # OAuth2 scheme for FastAPI dependency injection
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
-# Password hashing context
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Password hashing context (passlib/bcrypt are imported on first use, not at startup)
+@lru_cache(maxsize=None)
+def get_pwd_context():
+    from passlib.context import CryptContext
+    return CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 # --- Password Utilities ---
 def hash_password(password: str) -> str:
     """Hash a plain-text password using bcrypt."""
-    return pwd_context.hash(password)
+    return get_pwd_context().hash(password)
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verify a password against its hashed version."""
-    return pwd_context.verify(plain_password, hashed_password)
+    return get_pwd_context().verify(plain_password, hashed_password)
 
 # --- Token Generation ---
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     """Create a JWT access token."""
+    from jose import jwt
+
     to_encode = data.copy()
     expire = datetime.utcnow() + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
     to_encode.update({"exp": expire})
@@ -42,6 +46,8 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
 # --- Token Verification ---
 def verify_token(token: str) -> dict:
     """Decode and verify the JWT token."""
+    from jose import JWTError, jwt
+
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         return payload
@@ -0,0 +1,201 @@
+"""
+In-memory snapshot of subjects and chapters.
+
+List queries read reflections without joining chapters/subjects and take
+names and obsolete flags from here instead. Curriculum mutations send a
+NOTIFY on CHANNEL in their transaction; every worker on every pod LISTENs
+on the primary and reloads as soon as the commit is delivered.
+
+Each worker loads the snapshot and starts its listener thread on first use,
+so nothing is shared across a fork. If the listener is down the snapshot is
+still reloaded once it is CURRICULUM_MAX_AGE seconds old.
+"""
+import logging
+import os
+import select
+import threading
+import time
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+from dotenv import load_dotenv
+
+from reflects.db import get_db_connection, get_listen_connection
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+CHANNEL = "curriculum_changed"
+CURRICULUM_MAX_AGE: float = float(os.getenv("CURRICULUM_MAX_AGE", 60))  # reload without a NOTIFY
+LISTEN_RETRY_SECONDS: float = float(os.getenv("CURRICULUM_LISTEN_RETRY", 5))
+
+
+class Subject(NamedTuple):
+    id: int
+    name: str
+    obsolete: bool
+
+class Chapter(NamedTuple):
+    id: int
+    subject_id: int
+    name: str
+    obsolete: bool
+
+
+class Snapshot:
+    """Immutable view of the curriculum; replaced wholesale on reload."""
+
+    def __init__(self, subjects: Dict[int, Subject], chapters: Dict[int, Chapter]):
+        self.subjects = subjects
+        self.chapters = chapters
+        self.loaded_at = time.monotonic()
+        # Chapters hidden by default: obsolete themselves or under an obsolete subject
+        self.obsolete_chapter_ids = sorted(
+            c.id for c in chapters.values() if c.obsolete or subjects[c.subject_id].obsolete
+        )
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[tuple]) -> "Snapshot":
+        """Rows of (subject id, name, obsolete, chapter id, name, obsolete); chapter may be NULL."""
+        subjects, chapters = {}, {}
+        for subject_id, subject_name, subject_obsolete, chapter_id, name, obsolete in rows:
+            subjects[subject_id] = Subject(subject_id, subject_name, subject_obsolete)
+            if chapter_id is not None:
+                chapters[chapter_id] = Chapter(chapter_id, subject_id, name, obsolete)
+        return cls(subjects, chapters)
+
+    def chapter_ids(self, subject_id: int) -> List[int]:
+        return sorted(c.id for c in self.chapters.values() if c.subject_id == subject_id)
+
+    def describe(self, chapter_id: int) -> dict:
+        """Names and obsolete flags the list routes used to join in."""
+        chapter = self.chapters[chapter_id]
+        subject = self.subjects[chapter.subject_id]
+        return {
+            "subject_id": subject.id,
+            "chapter_name": chapter.name,
+            "subject_name": subject.name,
+            "chapter_obsolete": chapter.obsolete,
+            "subject_obsolete": subject.obsolete,
+        }
+
+
+LOAD_QUERY = """
+    SELECT s.id, s.name, s.obsolete, c.id, c.name, c.obsolete
+    FROM subjects s
+    LEFT JOIN chapters c ON c.subject_id = s.id
+"""
+
+def load(conn) -> Snapshot:
+    cur = conn.cursor()
+    try:
+        cur.execute(LOAD_QUERY)
+        return Snapshot.from_rows(cur.fetchall())
+    finally:
+        cur.close()
+
+
+_snapshot: Optional[Snapshot] = None
+_stale = True
+_lock = threading.Lock()
+
+def refresh(conn=None) -> Snapshot:
+    """Reload from the primary (or the given autocommit connection) and publish it."""
+    global _snapshot, _stale
+    with _lock:
+        # Cleared before loading: a change committed mid-load marks it stale again
+        _stale = False
+        if conn is not None:
+            snapshot = load(conn)
+        else:
+            conn = get_db_connection()
+            conn.autocommit = True
+            try:
+                snapshot = load(conn)
+            finally:
+                conn.close()
+        _snapshot = snapshot
+        return snapshot
+
+def invalidate():
+    """Reload on next use; this worker's own writes are visible without waiting for NOTIFY."""
+    global _stale
+    _stale = True
+
+def get_snapshot(chapter_ids: Iterable[int] = ()) -> Snapshot:
+    """
+    Current snapshot, guaranteed to contain chapter_ids.
+
+    Reloads when invalidated, older than CURRICULUM_MAX_AGE, or missing one
+    of chapter_ids (created after the last reload).
+    """
+    start_listener()
+    snapshot = _snapshot
+    if (snapshot is None or _stale
+            or time.monotonic() - snapshot.loaded_at > CURRICULUM_MAX_AGE
+            or any(cid not in snapshot.chapters for cid in chapter_ids)):
+        snapshot = refresh()
+    return snapshot
+
+def notify_changed(cur):
+    """Queue a change notification; Postgres delivers it when the transaction commits."""
+    cur.execute("SELECT pg_notify(%s, '')", (CHANNEL,))
+
+
+# --- Listener ---
+def _listen(stop: threading.Event):
+    while not stop.is_set():
+        conn = None
+        try:
+            conn = get_listen_connection()
+            cur = conn.cursor()
+            cur.execute(f"LISTEN {CHANNEL}")
+            cur.close()
+            # Notifications sent while we were not listening are lost
+            refresh(conn)
+            while not stop.is_set():
+                # Notifications that arrived during a reload are already queued
+                if not conn.notifies:
+                    if select.select([conn], [], [], 1) == ([], [], []):
+                        continue
+                    conn.poll()
+                if conn.notifies:
+                    # One reload covers a burst of changes
+                    conn.notifies.clear()
+                    refresh(conn)
+        except Exception as e:
+            logger.warning("Curriculum listener error, retrying in %ss: %s",
+                           LISTEN_RETRY_SECONDS, e)
+            invalidate()
+            stop.wait(LISTEN_RETRY_SECONDS)
+        finally:
+            if conn is not None:
+                conn.close()
+
+
+_thread: Optional[threading.Thread] = None
+_stop = threading.Event()
+_thread_lock = threading.Lock()
+
+def start_listener():
+    """Start this process's LISTEN thread (after fork); no-op if running."""
+    global _thread
+    if _thread is not None:
+        return
+    with _thread_lock:
+        if _thread is not None:
+            return
+        _stop.clear()
+        _thread = threading.Thread(target=_listen, args=(_stop,),
+                                   name="curriculum-listener", daemon=True)
+        _thread.start()
+
+def stop_listener(timeout: Optional[float] = 2):
+    global _thread
+    _stop.set()
+    with _thread_lock:
+        if _thread is not None:
+            _thread.join(timeout)
+        _thread = None
@@ -1,20 +1,287 @@
+import itertools
+import logging
 import os
+import threading
+import time
+from typing import Optional
+
 import psycopg2
+import psycopg2.extensions
 from dotenv import load_dotenv
 
+from reflects.queries import CountingCursor, count_round_trip
+
 # Load environment variables from .env
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# --- Pooling ---
+DB_POOL_SIZE: int = int(os.getenv("DB_POOL_SIZE", 10))  # idle connections kept per database
+# Idle seconds after which a connection is pinged on checkout
+DB_POOL_PING_AFTER: float = float(os.getenv("DB_POOL_PING_AFTER", 5))
+
+# --- Read Replicas ---
+# Comma-separated libpq DSNs, e.g. "host=replica-1 dbname=reflects user=app password=..."
+DB_REPLICA_DSNS = [
+    dsn.strip() for dsn in os.getenv("DB_REPLICA_DSNS", "").split(",") if dsn.strip()
+]
+REPLICA_MAX_LAG_SECONDS: float = float(os.getenv("REPLICA_MAX_LAG_SECONDS", 5))
+REPLICA_CHECK_INTERVAL: float = float(os.getenv("REPLICA_CHECK_INTERVAL", 5))  # lag re-check
+REPLICA_RETRY_AFTER: float = float(os.getenv("REPLICA_RETRY_AFTER", 30))  # after a failed connect
+REPLICA_CONNECT_TIMEOUT: int = int(os.getenv("REPLICA_CONNECT_TIMEOUT", 2))
+READ_YOUR_WRITES_SECONDS: int = int(os.getenv("READ_YOUR_WRITES_SECONDS", 10))
+
+
+class PooledConnection(psycopg2.extensions.connection):
+    """
+    Connection whose close() returns it to its pool.
+
+    Routes keep calling conn.close(); the session, and the statements
+    prepared on it (reflects.queries), survive for the next request.
+    """
+    pool = None
+    released_at = 0.0
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+    def commit(self):
+        count_round_trip()
+        return super().commit()
+
+    def rollback(self):
+        count_round_trip()
+        return super().rollback()
+
+    def close(self):
+        if self.pool is not None and not self.closed:
+            self.pool.release(self)
+        else:
+            super().close()
+
+    def discard(self):
+        """Really close the connection."""
+        super().close()
+
+
+class ConnectionPool:
+    """
+    Per-process LIFO pool of idle connections to one database.
+
+    A connection idle for DB_POOL_PING_AFTER seconds is pinged on checkout;
+    if the ping fails the server has probably restarted or dropped idle
+    sessions, so every idle connection is discarded and a new one is made.
+    """
+
+    def __init__(self, connect, max_idle: int = DB_POOL_SIZE, autocommit: bool = False):
+        self._connect = connect
+        self.max_idle = max_idle
+        self.autocommit = autocommit
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def acquire(self) -> PooledConnection:
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                conn = self._idle.pop()
+            if conn.closed:
+                continue
+            if time.monotonic() - conn.released_at < DB_POOL_PING_AFTER or self._alive(conn):
+                return conn
+            logger.warning("Discarding idle database connections after a failed ping")
+            conn.discard()
+            self.clear()
+        conn = self._connect()
+        conn.pool = self
+        return conn
+
+    @staticmethod
+    def _alive(conn: PooledConnection) -> bool:
+        # Autocommit so the ping does not also need a BEGIN and a ROLLBACK
+        autocommit = conn.autocommit
+        try:
+            conn.autocommit = True
+            cur = conn.cursor()
+            try:
+                cur.execute("SELECT 1")
+            finally:
+                cur.close()
+            conn.autocommit = autocommit
+            return True
+        except psycopg2.Error:
+            return False
+
+    def clear(self):
+        """Close every idle connection."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.discard()
+
+    def release(self, conn: PooledConnection):
+        if conn.closed:
+            return
+        status = conn.info.transaction_status
+        if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+            conn.discard()
+            return
+        if status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            conn.rollback()
+        if conn.autocommit != self.autocommit:
+            conn.autocommit = self.autocommit
+        conn.released_at = time.monotonic()
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+        conn.discard()
+
+
+def _connect_primary():
+    return psycopg2.connect(
+        host=os.environ["DB_HOST"],
+        database=os.environ["DB_NAME"],
+        user=os.environ["DB_USER"],
+        password=os.environ["DB_PASS"],
+        port=os.environ["DB_PORT"],
+        connection_factory=PooledConnection,
+        cursor_factory=CountingCursor,
+    )
+
+_primary_pool = ConnectionPool(_connect_primary)
+
 def get_db_connection():
     """Establish and return a secure PostgreSQL database connection."""
     try:
+        return _primary_pool.acquire()
+    except Exception as e:
+        raise RuntimeError(f"Database connection failed: {e}")
+
+def get_listen_connection():
+    """Dedicated autocommit connection to the primary for LISTEN; never pooled."""
+    conn = _connect_primary()
+    conn.autocommit = True
+    return conn
+
+
+class Replica:
+    """Health and lag state for one read replica."""
+
+    def __init__(self, dsn: str):
+        self.dsn = dsn
+        self.skip_until = 0.0
+        self.checked_at = 0.0
+        self.pool = ConnectionPool(self._connect, autocommit=True)
+
+    def _connect(self):
         conn = psycopg2.connect(
-            host=os.environ["DB_HOST"],
-            database=os.environ["DB_NAME"],
-            user=os.environ["DB_USER"],
-            password=os.environ["DB_PASS"],
-            port=os.environ["DB_PORT"],
+            self.dsn,
+            connect_timeout=REPLICA_CONNECT_TIMEOUT,
+            connection_factory=PooledConnection,
+            cursor_factory=CountingCursor,
         )
+        conn.set_session(readonly=True, autocommit=True)
         return conn
+
+    def available(self, now: float) -> bool:
+        return now >= self.skip_until
+
+    def connect(self):
+        """Pooled connection, re-checking lag every REPLICA_CHECK_INTERVAL; None if unusable."""
+        now = time.monotonic()
+        try:
+            conn = self.pool.acquire()
+        except psycopg2.Error as e:
+            logger.warning("Read replica unavailable for %ss: %s", REPLICA_RETRY_AFTER, e)
+            self.skip_until = now + REPLICA_RETRY_AFTER
+            return None
+
+        if now - self.checked_at >= REPLICA_CHECK_INTERVAL:
+            try:
+                lag = replication_lag(conn)
+            except psycopg2.Error:
+                lag = None
+            self.checked_at = now
+            if lag is None or lag > REPLICA_MAX_LAG_SECONDS:
+                logger.warning("Read replica lagging (%ss), falling back", lag)
+                self.skip_until = now + REPLICA_CHECK_INTERVAL
+                conn.close()
+                return None
+        return conn
+
+def replication_lag(conn) -> float:
+    """Seconds the replica is behind; 0 when it has replayed everything it received."""
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            SELECT CASE
+                WHEN NOT pg_is_in_recovery() THEN 0
+                WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+            END
+        """)
+        return float(cur.fetchone()[0])
+    finally:
+        cur.close()
+
+
+_replicas = [Replica(dsn) for dsn in DB_REPLICA_DSNS]
+_replica_counter = itertools.count()
+_replica_lock = threading.Lock()
+
+def _next_replicas() -> list:
+    """All replicas, starting from the next one in round-robin order."""
+    with _replica_lock:
+        start = next(_replica_counter) % len(_replicas)
+    return _replicas[start:] + _replicas[:start]
+
+
+# --- Read-your-writes ---
+def _write_key(user_id: int) -> str:
+    return f"rw:user:{user_id}"
+
+def mark_recent_write(user_id: int):
+    """Pin this user's reads to the primary for READ_YOUR_WRITES_SECONDS (all pods, via Redis)."""
+    if not _replicas:
+        return
+    from reflects.redis_client import get_redis
+    try:
+        get_redis().set(_write_key(user_id), 1, ex=READ_YOUR_WRITES_SECONDS)
     except Exception as e:
-        raise RuntimeError(f"Database connection failed: {e}")
+        logger.warning("Could not record recent write for user %s: %s", user_id, e)
+
+def has_recent_write(user_id: int) -> bool:
+    from reflects.redis_client import get_redis
+    try:
+        return bool(get_redis().exists(_write_key(user_id)))
+    except Exception:
+        # Can't tell, so stay consistent
+        return True
+
+
+def get_read_connection(user_id: Optional[int] = None):
+    """
+    Connection for read-only routes.
+
+    Round-robins over healthy replicas within the lag threshold and falls
+    back to the primary when none is usable, when no replicas are
+    configured, or when user_id wrote recently.
+    """
+    if _replicas and (user_id is None or not has_recent_write(user_id)):
+        now = time.monotonic()
+        for replica in _next_replicas():
+            if not replica.available(now):
+                continue
+            conn = replica.connect()
+            if conn is not None:
+                return conn
+
+    # Reads need no transaction: autocommit saves the BEGIN/ROLLBACK round trip.
+    # The pool restores the primary's default when the connection is returned.
+    conn = get_db_connection()
+    conn.autocommit = True
+    return conn
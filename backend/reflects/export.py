@@ -0,0 +1,132 @@
+"""
+Streaming exports of query results as CSV or Parquet.
+
+Rows come from a server-side (named) cursor EXPORT_BATCH_SIZE at a time and
+each batch is encoded and sent before the next is fetched, so memory stays
+flat however many rows the query matches. Parquet is written with
+``pyarrow``, imported on first use so workers that never export don't load it.
+"""
+import csv
+import io
+import os
+import uuid
+from typing import Callable, Iterator, List, Sequence, Tuple
+
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# --- Configuration ---
+EXPORT_BATCH_SIZE: int = int(os.getenv("EXPORT_BATCH_SIZE", 2000))  # rows per fetch / row group
+
+FORMATS = {
+    "csv": "text/csv; charset=utf-8",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+# Column kinds understood by both writers
+Columns = List[Tuple[str, str]]  # (name, "int" | "str" | "bool" | "timestamp")
+
+
+def parquet_available() -> bool:
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def fetch_batches(conn, query: str, params: Sequence, batch_size: int = EXPORT_BATCH_SIZE):
+    """
+    Run query on a named cursor and yield lists of up to batch_size rows.
+
+    Closes the cursor and the connection when exhausted or closed early.
+    """
+    try:
+        # Named cursors live inside a transaction; the pool rolls it back on release
+        conn.autocommit = False
+        cur = conn.cursor(name=f"export_{uuid.uuid4().hex}")
+        cur.itersize = batch_size
+        try:
+            cur.execute(query, tuple(params))
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    return
+                yield rows
+        finally:
+            cur.close()
+    finally:
+        conn.close()
+
+
+def stream_csv(batches: Iterator[list], columns: Columns,
+               transform: Callable[[tuple], Sequence]) -> Iterator[bytes]:
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow([name for name, _ in columns])
+    for rows in batches:
+        writer.writerows(transform(r) for r in rows)
+        yield buf.getvalue().encode("utf-8")
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue().encode("utf-8")
+
+
+class _ChunkSink:
+    """Write-only file object for pyarrow; the caller drains what was written."""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data, self.chunks = b"".join(self.chunks), []
+        return data
+
+
+def stream_parquet(batches: Iterator[list], columns: Columns,
+                   transform: Callable[[tuple], Sequence]) -> Iterator[bytes]:
+    """One row group per batch; bytes are sent as soon as each group is written."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    types = {
+        "int": pa.int64(),
+        "str": pa.string(),
+        "bool": pa.bool_(),
+        "timestamp": pa.timestamp("us"),
+    }
+    schema = pa.schema([(name, types[kind]) for name, kind in columns])
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema)
+    try:
+        for rows in batches:
+            values = [transform(r) for r in rows]
+            arrays = [
+                pa.array([v[i] for v in values], type=field.type)
+                for i, field in enumerate(schema)
+            ]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
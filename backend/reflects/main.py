@@ -1,22 +1,38 @@
-from fastapi import FastAPI, HTTPException, Depends, Form, File, UploadFile, Query, Body
+from fastapi import FastAPI, HTTPException, Depends, Form, File, UploadFile, Query, Body, Request
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel, EmailStr, constr, validator
 from typing import Optional, Literal
-from datetime import datetime, timedelta
-from azure.storage.blob import BlobServiceClient, generate_blob_sas, BlobSasPermissions
-from passlib.context import CryptContext
+from datetime import datetime
 import os
 import re
+import time
 
-from reflects.db import get_db_connection
+from reflects.db import get_db_connection, get_read_connection, mark_recent_write
+from reflects import queries
 from reflects.auth import create_access_token, get_current_user
 from reflects.redis_client import hybrid_rate_limiter
 from reflects.auth import hash_password
 from reflects.auth import verify_password
+from reflects.storage import get_sas_url, get_storage, LocalFileBackend, DEFAULT_VIDEO_TYPE
+from reflects.streaming import RangeFileResponse
+from reflects import curriculum, export
+from reflects.shedding import LoadSheddingMiddleware, render_metrics
+from reflects.media import purge_media, shutdown as shutdown_media
+from reflects.submissions import (
+    QUEUE_RETRY_AFTER, SUBMIT_MODE, QueueUnavailable, create_reflection, enqueue_submission,
+    get_job, job_status,
+    start_workers as start_submission_workers, stop_workers as stop_submission_workers,
+)
 
 app = FastAPI(docs_url="/api/docs", openapi_url="/api/openapi.json")
 
+app.add_middleware(queries.RoundTripMiddleware)
+
+# Inside CORS so shed 503s still carry CORS headers for the browser
+app.add_middleware(LoadSheddingMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:3000"],
@@ -90,53 +106,115 @@ class StudentUpdate(BaseModel):
 def health_check():
     return {"status": "ok"}
 
-# ----- Environment Config -----
-ENV = os.getenv("ENV", "local")
-AZURE_CONTAINER = os.getenv("AZURE_STORAGE_CONTAINER_NAME", "uploads")
-AZURE_CONN_STR = os.getenv("AZURE_STORAGE_CONNECTION_STRING")
+# Set by the ingress controller on everything it forwards; Prometheus scrapes pod IPs directly
+PROXY_HEADERS = ("x-forwarded-for", "x-real-ip", "forwarded")
 
-# ----- Utility Functions -----
-def upload_to_azure(file, object_name: str):
-    try:
-        blob_service_client = BlobServiceClient.from_connection_string(AZURE_CONN_STR)
-        container_client = blob_service_client.get_container_client(AZURE_CONTAINER)
-        blob_client = container_client.get_blob_client(object_name)
-        blob_client.upload_blob(file.file, overwrite=True)
-    except Exception as e:
-        raise Exception(f"Azure upload failed: {str(e)}")
-
-def get_sas_url(blob_name: str):
-    blob_service_client = BlobServiceClient.from_connection_string(AZURE_CONN_STR)
-    blob_client = blob_service_client.get_blob_client(container=AZURE_CONTAINER, blob=blob_name)
-
-    # Get the storage account key from an env variable
-    account_key = os.getenv("AZURE_STORAGE_ACCOUNT_KEY")
-    if not account_key:
-        raise RuntimeError("AZURE_STORAGE_ACCOUNT_KEY is not set in environment variables.")
-
-    sas_token = generate_blob_sas(
-        account_name=blob_client.account_name,
-        container_name=blob_client.container_name,
-        blob_name=blob_name,
-        account_key=account_key,
-        permission=BlobSasPermissions(read=True),
-        expiry=datetime.utcnow() + timedelta(hours=1)
-    )
+@app.get("/metrics", include_in_schema=False)
+def metrics(request: Request):
+    """Prometheus scrape endpoint (per worker process); not served through the ingress."""
+    if any(header in request.headers for header in PROXY_HEADERS):
+        raise HTTPException(status_code=404, detail="Not Found")
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
 
-    return f"{blob_client.url}?{sas_token}"
+@app.on_event("startup")
+def start_background_workers():
+    if SUBMIT_MODE == "async":
+        start_submission_workers()
 
+@app.on_event("shutdown")
+def stop_background_workers():
+    # Queued submissions first: they hand transcodes to the media pool
+    stop_submission_workers()
+    shutdown_media()
+    curriculum.stop_listener()
 
+# ----- Utility Functions -----
+Rendition = Literal["web", "original"]
+
+def signed_media(video_url: str, web_video_url: Optional[str], thumbnail_url: Optional[str],
+                 rendition: str = "web"):
+    """Signed (video, thumbnail) URLs, preferring the light web rendition once it exists."""
+    source = web_video_url if rendition == "web" and web_video_url else video_url
+    return get_sas_url(source), get_sas_url(thumbnail_url) if thumbnail_url else None
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+_media_types: dict = {}
 
-def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
+def stored_media_type(key: str) -> Optional[str]:
+    """
+    Content type recorded for a content-addressed original; None to guess from the extension.
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+    Originals (videos/<sha256>) have no extension, so Starlette would send
+    text/plain. The bytes behind a key never change, so answers are cached.
+    """
+    if os.path.splitext(key)[1]:
+        return None  # renditions and pre-deduplication uploads
+    media_type = _media_types.get(key)
+    if media_type is None:
+        conn = get_read_connection()
+        cur = conn.cursor()
+        try:
+            queries.execute(cur, "media_content_type", (key,))
+            row = cur.fetchone()
+        finally:
+            cur.close()
+            conn.close()
+        if row is None:
+            # Not committed yet (or not visible on this replica); don't cache
+            return DEFAULT_VIDEO_TYPE
+        if len(_media_types) >= 10000:
+            _media_types.clear()
+        media_type = _media_types[key] = row[0] or DEFAULT_VIDEO_TYPE
+    return media_type
+
+def reflection_filters(email: Optional[str], subject_id: Optional[int],
+                       chapter_id: Optional[int], include_obsolete: bool):
+    """
+    WHERE clauses shared by the teacher reflection listings, search and export.
 
+    Expects the aliases r (reflections) and u (users); chapter and subject
+    conditions become chapter id lists from the curriculum snapshot, so no
+    join is needed. Returns (" AND ..." SQL, params).
+    """
+    sql, params = "", []
+    snapshot = curriculum.get_snapshot()
+    if not include_obsolete:
+        sql += " AND r.obsolete = FALSE"
+        if snapshot.obsolete_chapter_ids:
+            sql += " AND r.chapter_id <> ALL(%s)"
+            params.append(snapshot.obsolete_chapter_ids)
+    if email:
+        sql += " AND u.email = %s"
+        params.append(email)
+    if chapter_id:
+        sql += " AND r.chapter_id = %s"
+        params.append(chapter_id)
+    elif subject_id:
+        sql += " AND r.chapter_id = ANY(%s)"
+        params.append(snapshot.chapter_ids(subject_id))
+    return sql, params
 
 # ----- Routes -----
+@app.api_route("/media/{key:path}", methods=["GET", "HEAD"])
+def stream_media(key: str, request: Request, expires: int = Query(...), sig: str = Query(...)):
+    """Serve locally stored videos and thumbnails behind signed, expiring URLs."""
+    storage = get_storage()
+    if not isinstance(storage, LocalFileBackend):
+        raise HTTPException(status_code=404, detail="Not found")
+    if not storage.verify(key, expires, sig):
+        raise HTTPException(status_code=403, detail="Invalid or expired media URL")
+    try:
+        path = storage.path(key)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Not found")
+    if not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="Not found")
+    return RangeFileResponse(
+        path,
+        range_header=request.headers.get("range"),
+        media_type=stored_media_type(key),
+        headers={"Cache-Control": f"private, max-age={max(expires - int(time.time()), 0)}"},
+    )
+
 @app.get("/test-version")
 def test_version():
     return {"version": "api-docs-fix"}
@@ -165,7 +243,7 @@ def login(form_data: OAuth2PasswordRequestForm = Depends()):
     conn = get_db_connection()
     cur = conn.cursor()
     try:
-        cur.execute("SELECT id, password, role FROM users WHERE email = %s", (form_data.username,))
+        queries.execute(cur, "user_login", (form_data.username,))
         user = cur.fetchone()
         if not user or not verify_password(form_data.password, user[1]):
             raise HTTPException(status_code=401, detail="Invalid credentials")
@@ -177,10 +255,10 @@ def login(form_data: OAuth2PasswordRequestForm = Depends()):
 
 @app.get("/me")
 def read_me(user=Depends(get_current_user)):
-    conn = get_db_connection()
+    conn = get_read_connection(user["user_id"])
     cur = conn.cursor()
     try:
-        cur.execute("SELECT name, email FROM users WHERE id = %s", (user["user_id"],))
+        queries.execute(cur, "user_profile", (user["user_id"],))
         result = cur.fetchone()
         if not result:
             raise HTTPException(status_code=404, detail="User not found")
@@ -202,6 +280,7 @@ def update_user(updates: UserUpdate, user=Depends(get_current_user)):
             hashed_pw = hash_password(updates.password)
             cur.execute("UPDATE users SET password = %s WHERE id = %s", (hashed_pw, user["user_id"]))
         conn.commit()
+        mark_recent_write(user["user_id"])
         return {"message": "User updated successfully"}
     except Exception as e:
         conn.rollback()
@@ -226,25 +305,16 @@ def delete_student(email: str, user=Depends(get_current_user)):
     conn = get_db_connection()
     cur = conn.cursor()
     try:
-        cur.execute("SELECT id FROM users WHERE email = %s AND role = 'student'", (email,))
-        student = cur.fetchone()
-        if not student:
+        # Feedback, reflections, video references and the account go in one statement
+        queries.execute(cur, "student_delete", (email,))
+        student_id, unreferenced = cur.fetchone()
+        if student_id is None:
+            conn.rollback()
             raise HTTPException(status_code=404, detail="Student not found")
-        student_id = student[0]
-
-        # Delete all feedback related to the student
-        cur.execute("""
-            DELETE FROM feedback
-            WHERE reflection_id IN (SELECT id FROM reflections WHERE user_id = %s)
-        """, (student_id,))
-
-        # Delete all reflections by the student
-        cur.execute("DELETE FROM reflections WHERE user_id = %s", (student_id,))
-
-        # Delete the student account
-        cur.execute("DELETE FROM users WHERE id = %s", (student_id,))
 
         conn.commit()
+        mark_recent_write(user["user_id"])
+        purge_media(unreferenced)
         return {"message": f"Student {email} and all their data have been permanently deleted."}
     finally:
         cur.close()
@@ -272,6 +342,7 @@ def update_student(email: str, updates: StudentUpdate, user=Depends(get_current_
             hashed_pw = hash_password(updates.password)
             cur.execute("UPDATE users SET password = %s WHERE email = %s AND role = 'student'", (hashed_pw, email))
         conn.commit()
+        mark_recent_write(user["user_id"])
         return {"message": f"Student {email} updated successfully"}
     finally:
         cur.close()
@@ -282,81 +353,92 @@ def submit_reflection(
     chapter_id: int = Form(...),
     text_summary: str = Form(None),
     video_file: UploadFile = File(...),
+    mode: Literal["sync", "async"] = Query(SUBMIT_MODE),
     user=Depends(get_current_user)
 ):
     if not hybrid_rate_limiter(user["user_id"], "reflection", 10):
         raise HTTPException(status_code=429, detail="Reflection rate limit reached.")
 
-    file_name = f"{user['user_id']}_{chapter_id}_{video_file.filename}"
-
-    if ENV == "production":
-        upload_to_azure(video_file, file_name)
-    else:
-        os.makedirs("uploads", exist_ok=True)
-        with open(f"uploads/{file_name}", "wb") as f:
-            f.write(video_file.file.read())
+    if mode == "async":
+        # Storage upload and insert happen in the background; poll the status URL
+        try:
+            job_id = enqueue_submission(
+                user["user_id"], chapter_id, text_summary, video_file.file, video_file.content_type
+            )
+        except QueueUnavailable as e:
+            raise HTTPException(status_code=503, detail=str(e),
+                                headers={"Retry-After": str(QUEUE_RETRY_AFTER)})
+        return JSONResponse(status_code=202, content={
+            **job_status(job_id),
+            "status_url": f"/submit-reflection/jobs/{job_id}",
+        })
 
-    conn = get_db_connection()
-    cur = conn.cursor()
     try:
-        cur.execute("""
-            INSERT INTO reflections (user_id, chapter_id, video_url, text_summary, submitted_at)
-            VALUES (%s, %s, %s, %s, %s)
-        """, (user["user_id"], chapter_id, file_name, text_summary.strip() if text_summary else None, datetime.utcnow()))
-        conn.commit()
-        return {"message": "Reflection submitted successfully"}
+        reflection_id = create_reflection(
+            user["user_id"], chapter_id, text_summary, video_file.file, video_file.content_type
+        )
     except Exception as e:
-        conn.rollback()
-        if "unique_user_chapter" in str(e):
-            raise HTTPException(status_code=400, detail="Already submitted for this chapter.")
         raise HTTPException(status_code=400, detail=str(e))
-    finally:
-        cur.close()
-        conn.close()
+    if reflection_id is None:
+        raise HTTPException(status_code=400, detail="Already submitted for this chapter.")
+    return {"message": "Reflection submitted successfully"}
+
+@app.get("/submit-reflection/jobs/{job_id}")
+def get_submission_job(job_id: str, user=Depends(get_current_user)):
+    job = get_job(job_id)
+    if not job or int(job["user_id"]) != user["user_id"]:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job_status(job_id)
 
 @app.get("/my-reflections")
 def get_my_reflections(
     subject_id: Optional[int] = Query(None),
+    rendition: Rendition = Query("web"),
     user=Depends(get_current_user)
 ):
-    conn = get_db_connection()
+    conn = get_read_connection(user["user_id"])
     cur = conn.cursor()
     try:
+        # Chapter and subject names/flags come from the curriculum snapshot
         query = """
             SELECT 
                 r.chapter_id, 
-                c.name AS chapter_name, 
-                s.name AS subject_name,
                 r.video_url, 
                 r.text_summary, 
                 r.submitted_at,
                 r.obsolete AS reflection_obsolete,
-                c.obsolete AS chapter_obsolete,
-                s.obsolete AS subject_obsolete
+                r.web_video_url,
+                r.thumbnail_url
             FROM reflections r
-            JOIN chapters c ON r.chapter_id = c.id
-            JOIN subjects s ON c.subject_id = s.id
             WHERE r.user_id = %s
         """
         params = [user["user_id"]]
 
         if subject_id:
-            query += " AND c.subject_id = %s"
-            params.append(subject_id)
+            query += " AND r.chapter_id = ANY(%s)"
+            params.append(curriculum.get_snapshot().chapter_ids(subject_id))
 
         query += " ORDER BY r.submitted_at DESC"
         cur.execute(query, tuple(params))
-
-        return [{
-            "chapter": row[1],
-            "subject": row[2],
-            "video_url": get_sas_url(row[3]),
-            "summary": row[4],
-            "submitted_at": row[5].isoformat(),
-            "reflection_obsolete": row[6],
-            "chapter_obsolete": row[7],
-            "subject_obsolete": row[8]
-        } for row in cur.fetchall()]
+        rows = cur.fetchall()
+
+        snapshot = curriculum.get_snapshot(row[0] for row in rows)
+        results = []
+        for row in rows:
+            info = snapshot.describe(row[0])
+            video_url, thumbnail_url = signed_media(row[1], row[5], row[6], rendition)
+            results.append({
+                "chapter": info["chapter_name"],
+                "subject": info["subject_name"],
+                "video_url": video_url,
+                "thumbnail_url": thumbnail_url,
+                "summary": row[2],
+                "submitted_at": row[3].isoformat(),
+                "reflection_obsolete": row[4],
+                "chapter_obsolete": info["chapter_obsolete"],
+                "subject_obsolete": info["subject_obsolete"]
+            })
+        return results
     finally:
         cur.close()
         conn.close()
@@ -365,10 +447,10 @@ def get_my_reflections(
 
 @app.get("/chapters")
 def get_chapters():
-    conn = get_db_connection()
+    conn = get_read_connection()
     cur = conn.cursor()
     try:
-        cur.execute("SELECT id, name FROM chapters WHERE obsolete = FALSE ORDER BY id")
+        queries.execute(cur, "active_chapters")
         return [{"id": row[0], "name": row[1]} for row in cur.fetchall()]
     finally:
         cur.close()
@@ -377,10 +459,10 @@ def get_chapters():
 
 @app.get("/subjects")
 def get_subjects(user=Depends(get_current_user)):
-    conn = get_db_connection()
+    conn = get_read_connection(user["user_id"])
     cur = conn.cursor()
     try:
-        cur.execute("SELECT id, name FROM subjects WHERE obsolete = FALSE ORDER BY name")
+        queries.execute(cur, "active_subjects")
         return [{"id": row[0], "name": row[1]} for row in cur.fetchall()]
     finally:
         cur.close()
@@ -395,24 +477,11 @@ def create_subject(subject: SubjectCreate, user=Depends(get_current_user)):
     conn = get_db_connection()
     cur = conn.cursor()
     try:
-        # Check if subject with same name exists
-        cur.execute("SELECT id, obsolete FROM subjects WHERE name = %s", (subject.name.strip(),))
-        existing = cur.fetchone()
-
-        if existing:
-            subject_id, is_obsolete = existing
-            if is_obsolete:
-                # Revive the obsolete subject
-                cur.execute("UPDATE subjects SET obsolete = FALSE WHERE id = %s", (subject_id,))
-                conn.commit()
-                return {"id": subject_id, "name": subject.name}
-            else:
-                raise HTTPException(status_code=400, detail="Subject with this name already exists.")
-
-        # Otherwise insert new
-        cur.execute("INSERT INTO subjects (name) VALUES (%s) RETURNING id", (subject.name.strip(),))
+        # Insert, or revive a soft-deleted subject of the same name, and notify, in one statement
+        queries.execute(cur, "subject_upsert", (subject.name.strip(),))
+        row = cur.fetchone()
         conn.commit()
-        return {"id": cur.fetchone()[0], "name": subject.name}
+        curriculum.invalidate()
     except Exception as e:
         conn.rollback()
         raise HTTPException(status_code=400, detail=str(e))
@@ -420,6 +489,11 @@ def create_subject(subject: SubjectCreate, user=Depends(get_current_user)):
         cur.close()
         conn.close()
 
+    if row is None:
+        raise HTTPException(status_code=400, detail="Subject with this name already exists.")
+    mark_recent_write(user["user_id"])
+    return {"id": row[0], "name": subject.name}
+
 
 
 @app.patch("/subjects/{subject_id}")
@@ -430,7 +504,10 @@ def update_subject(subject_id: int, updates: SubjectUpdate, user=Depends(get_cur
     cur = conn.cursor()
     try:
         cur.execute("UPDATE subjects SET name = %s WHERE id = %s", (updates.name.strip(), subject_id))
+        curriculum.notify_changed(cur)
         conn.commit()
+        curriculum.invalidate()
+        mark_recent_write(user["user_id"])
         return {"message": "Subject updated"}
     except Exception as e:
         conn.rollback()
@@ -462,7 +539,10 @@ def delete_subject(subject_id: int, user=Depends(get_current_user)):
                 WHERE c.subject_id = %s
             )
         """, (subject_id,))
+        curriculum.notify_changed(cur)
         conn.commit()
+        curriculum.invalidate()
+        mark_recent_write(user["user_id"])
         return {"message": "Subject marked as obsolete"}
     finally:
         cur.close()
@@ -471,10 +551,10 @@ def delete_subject(subject_id: int, user=Depends(get_current_user)):
 
 @app.get("/subjects/{subject_id}/chapters")
 def get_chapters_for_subject(subject_id: int, user=Depends(get_current_user)):
-    conn = get_db_connection()
+    conn = get_read_connection(user["user_id"])
     cur = conn.cursor()
     try:
-        cur.execute("SELECT id, name FROM chapters WHERE subject_id = %s AND obsolete = FALSE ORDER BY id", (subject_id,))
+        queries.execute(cur, "subject_chapters", (subject_id,))
         return [{"id": row[0], "name": row[1]} for row in cur.fetchall()]
     finally:
         cur.close()
@@ -492,8 +572,12 @@ def create_chapter(subject_id: int, chapter: ChapterCreate, user=Depends(get_cur
             "INSERT INTO chapters (subject_id, name) VALUES (%s, %s) RETURNING id",
             (subject_id, chapter.name.strip())
         )
+        chapter_id = cur.fetchone()[0]
+        curriculum.notify_changed(cur)
         conn.commit()
-        return {"id": cur.fetchone()[0], "name": chapter.name}
+        curriculum.invalidate()
+        mark_recent_write(user["user_id"])
+        return {"id": chapter_id, "name": chapter.name}
     except Exception as e:
         conn.rollback()
         raise HTTPException(status_code=400, detail=str(e))
@@ -509,7 +593,10 @@ def update_chapter(chapter_id: int, updates: ChapterUpdate, user=Depends(get_cur
     cur = conn.cursor()
     try:
         cur.execute("UPDATE chapters SET name = %s WHERE id = %s", (updates.name.strip(), chapter_id))
+        curriculum.notify_changed(cur)
         conn.commit()
+        curriculum.invalidate()
+        mark_recent_write(user["user_id"])
         return {"message": "Chapter updated"}
     except Exception as e:
         conn.rollback()
@@ -536,7 +623,10 @@ def delete_chapter(chapter_id: int, user=Depends(get_current_user)):
                 SELECT id FROM reflections WHERE chapter_id = %s
             )
         """, (chapter_id,))
+        curriculum.notify_changed(cur)
         conn.commit()
+        curriculum.invalidate()
+        mark_recent_write(user["user_id"])
         return {"message": "Chapter marked as obsolete"}
     finally:
         cur.close()
@@ -548,10 +638,10 @@ def delete_chapter(chapter_id: int, user=Depends(get_current_user)):
 def get_student_emails(user=Depends(get_current_user)):
     if user["role"] != "teacher":
         raise HTTPException(status_code=403, detail="Access denied")
-    conn = get_db_connection()
+    conn = get_read_connection(user["user_id"])
     cur = conn.cursor()
     try:
-        cur.execute("SELECT DISTINCT email FROM users WHERE role = 'student'")
+        queries.execute(cur, "student_emails")
         return [row[0] for row in cur.fetchall()]
     finally:
         cur.close()
@@ -565,6 +655,7 @@ def get_all_reflections(
     subject_id: Optional[int] = Query(None),
     chapter_id: Optional[int] = Query(None),
     include_obsolete: bool = Query(False),  # ✅ new param
+    rendition: Rendition = Query("web"),
     user=Depends(get_current_user)
 ):
     if user["role"] != "teacher":
@@ -581,67 +672,194 @@ def get_all_reflections(
             f.status, 
             f.comment,
             r.obsolete AS reflection_obsolete,
-            c.obsolete AS chapter_obsolete,
-            s.obsolete AS subject_obsolete,
-            c.name AS chapter_name,
-            s.name AS subject_name
+            r.web_video_url,
+            r.thumbnail_url
         FROM reflections r
         JOIN users u ON r.user_id = u.id
         LEFT JOIN feedback f ON r.id = f.reflection_id
-        JOIN chapters c ON r.chapter_id = c.id
-        JOIN subjects s ON c.subject_id = s.id
         WHERE (f.obsolete = FALSE OR f.obsolete IS NULL)
     """
-    params = []
+    filters, params = reflection_filters(email, subject_id, chapter_id, include_obsolete)
+    query += filters + " ORDER BY r.submitted_at DESC"
 
-    if not include_obsolete:
-        query += " AND r.obsolete = FALSE AND c.obsolete = FALSE AND s.obsolete = FALSE"
+    conn = get_read_connection(user["user_id"])
+    cur = conn.cursor()
+    try:
+        cur.execute(query, tuple(params))
+        rows = cur.fetchall()
+        snapshot = curriculum.get_snapshot(r[2] for r in rows)
+        results = []
+        for r in rows:
+            info = snapshot.describe(r[2])
+            video_url, thumbnail_url = signed_media(r[3], r[9], r[10], rendition)
+            results.append({
+                "id": r[0],
+                "email": r[1],
+                "chapter_id": r[2],
+                "video_url": video_url,
+                "thumbnail_url": thumbnail_url,
+                "text_summary": r[4],
+                "submitted_at": r[5].isoformat(),
+                "status": r[6],
+                "comment": r[7],
+                "reflection_obsolete": r[8],
+                "chapter_obsolete": info["chapter_obsolete"],
+                "subject_obsolete": info["subject_obsolete"],
+                "chapter_name": info["chapter_name"],
+                "subject_name": info["subject_name"],
+            })
+        return results
+    finally:
+        cur.close()
+        conn.close()
 
-    if email:
-        query += " AND u.email = %s"
-        params.append(email)
 
-    if chapter_id:
-        query += " AND r.chapter_id = %s"
-        params.append(chapter_id)
 
-    elif subject_id:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        try:
-            cur.execute("SELECT id FROM chapters WHERE subject_id = %s", (subject_id,))
-            chapter_ids = [row[0] for row in cur.fetchall()]
-        finally:
-            cur.close()
-            conn.close()
+@app.get("/reflections/export")
+def export_reflections(
+    format: Literal["csv", "parquet"] = Query("csv"),
+    email: Optional[str] = Query(None),
+    subject_id: Optional[int] = Query(None),
+    chapter_id: Optional[int] = Query(None),
+    include_obsolete: bool = Query(False),
+    sign_urls: bool = Query(False),
+    rendition: Rendition = Query("web"),
+    user=Depends(get_current_user)
+):
+    """
+    Stream the reflections /all-reflections would return, with feedback, as CSV or Parquet.
+
+    Video columns hold storage keys unless sign_urls is set (signed URLs expire).
+    """
+    if user["role"] != "teacher":
+        raise HTTPException(status_code=403, detail="Access denied")
+    if format == "parquet" and not export.parquet_available():
+        raise HTTPException(status_code=501, detail="Parquet export is not available")
+
+    query = """
+        SELECT
+            r.id,
+            u.email,
+            r.chapter_id,
+            r.submitted_at,
+            r.text_summary,
+            f.status,
+            f.comment,
+            f.updated_at,
+            r.video_url,
+            r.web_video_url,
+            r.thumbnail_url,
+            r.obsolete
+        FROM reflections r
+        JOIN users u ON r.user_id = u.id
+        LEFT JOIN feedback f ON r.id = f.reflection_id
+        WHERE (f.obsolete = FALSE OR f.obsolete IS NULL)
+    """
+    filters, params = reflection_filters(email, subject_id, chapter_id, include_obsolete)
+    query += filters + " ORDER BY r.submitted_at DESC, r.id"
+
+    columns = [
+        ("id", "int"), ("email", "str"), ("subject_id", "int"), ("subject_name", "str"),
+        ("chapter_id", "int"), ("chapter_name", "str"), ("submitted_at", "timestamp"),
+        ("text_summary", "str"), ("status", "str"), ("comment", "str"),
+        ("feedback_updated_at", "timestamp"), ("video_url", "str"), ("thumbnail_url", "str"),
+        ("reflection_obsolete", "bool"), ("chapter_obsolete", "bool"), ("subject_obsolete", "bool"),
+    ]
+
+    def to_row(r):
+        # Curriculum names and flags from the snapshot, reloaded if a chapter is new
+        info = curriculum.get_snapshot((r[2],)).describe(r[2])
+        if sign_urls:
+            video_url, thumbnail_url = signed_media(r[8], r[9], r[10], rendition)
+        else:
+            video_url = r[9] if rendition == "web" and r[9] else r[8]
+            thumbnail_url = r[10]
+        return (
+            r[0], r[1], info["subject_id"], info["subject_name"], r[2], info["chapter_name"],
+            *r[3:8], video_url, thumbnail_url,
+            r[11], info["chapter_obsolete"], info["subject_obsolete"],
+        )
+
+    batches = export.fetch_batches(get_read_connection(user["user_id"]), query, params)
+    writer = export.stream_parquet if format == "parquet" else export.stream_csv
+    filename = f"reflections-{datetime.utcnow():%Y%m%d-%H%M%S}.{format}"
+    return StreamingResponse(
+        writer(batches, columns, to_row),
+        media_type=export.FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
 
-        if not chapter_ids:
-            return []
 
-        query += " AND r.chapter_id = ANY(%s)"
-        params.append(chapter_ids)
+@app.get("/reflections/search")
+def search_reflections(
+    q: constr(strip_whitespace=True, min_length=1, max_length=200) = Query(...),
+    email: Optional[str] = Query(None),
+    subject_id: Optional[int] = Query(None),
+    chapter_id: Optional[int] = Query(None),
+    include_obsolete: bool = Query(False),
+    rendition: Rendition = Query("web"),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    user=Depends(get_current_user)
+):
+    """Ranked full-text search over reflection summaries and feedback comments."""
+    if user["role"] != "teacher":
+        raise HTTPException(status_code=403, detail="Access denied")
 
-    query += " ORDER BY r.submitted_at DESC"
+    # search_vector is maintained by triggers (migrations/003) and GIN-indexed
+    query = """
+        SELECT
+            r.id,
+            u.email,
+            r.chapter_id,
+            r.video_url,
+            r.text_summary,
+            r.submitted_at,
+            f.status,
+            f.comment,
+            r.obsolete AS reflection_obsolete,
+            r.web_video_url,
+            r.thumbnail_url,
+            ts_rank_cd(r.search_vector, tsq) AS rank
+        FROM reflections r
+        CROSS JOIN websearch_to_tsquery('english', %s) tsq
+        JOIN users u ON r.user_id = u.id
+        LEFT JOIN feedback f ON r.id = f.reflection_id
+        WHERE r.search_vector @@ tsq
+          AND (f.obsolete = FALSE OR f.obsolete IS NULL)
+    """
+    filters, filter_params = reflection_filters(email, subject_id, chapter_id, include_obsolete)
+    query += filters + " ORDER BY rank DESC, r.submitted_at DESC LIMIT %s OFFSET %s"
+    params = [q, *filter_params, limit, offset]
 
-    conn = get_db_connection()
+    conn = get_read_connection(user["user_id"])
     cur = conn.cursor()
     try:
         cur.execute(query, tuple(params))
-        return [{
-            "id": r[0],
-            "email": r[1],
-            "chapter_id": r[2],
-            "video_url": get_sas_url(r[3]),
-            "text_summary": r[4],
-            "submitted_at": r[5].isoformat(),
-            "status": r[6],
-            "comment": r[7],
-            "reflection_obsolete": r[8],
-            "chapter_obsolete": r[9],
-            "subject_obsolete": r[10],
-            "chapter_name": r[11],
-            "subject_name": r[12],
-        } for r in cur.fetchall()]
+        rows = cur.fetchall()
+        snapshot = curriculum.get_snapshot(r[2] for r in rows)
+        results = []
+        for r in rows:
+            info = snapshot.describe(r[2])
+            video_url, thumbnail_url = signed_media(r[3], r[9], r[10], rendition)
+            results.append({
+                "id": r[0],
+                "email": r[1],
+                "chapter_id": r[2],
+                "video_url": video_url,
+                "thumbnail_url": thumbnail_url,
+                "text_summary": r[4],
+                "submitted_at": r[5].isoformat(),
+                "status": r[6],
+                "comment": r[7],
+                "reflection_obsolete": r[8],
+                "chapter_obsolete": info["chapter_obsolete"],
+                "subject_obsolete": info["subject_obsolete"],
+                "chapter_name": info["chapter_name"],
+                "subject_name": info["subject_name"],
+                "rank": r[11],
+            })
+        return results
     finally:
         cur.close()
         conn.close()
@@ -659,13 +877,10 @@ def submit_feedback(data: FeedbackCreate, user=Depends(get_current_user)):
     conn = get_db_connection()
     cur = conn.cursor()
     try:
-        cur.execute("""
-            INSERT INTO feedback (reflection_id, teacher_id, status, comment, updated_at)
-            VALUES (%s, %s, %s, %s, NOW())
-            ON CONFLICT (reflection_id) DO UPDATE
-            SET status = EXCLUDED.status, comment = EXCLUDED.comment, updated_at = NOW()
-        """, (data.reflection_id, user["user_id"], data.status, data.comment))
+        queries.execute(cur, "feedback_upsert",
+                        (data.reflection_id, user["user_id"], data.status, data.comment))
         conn.commit()
+        mark_recent_write(user["user_id"])
         return {"message": "Feedback saved"}
     finally:
         cur.close()
@@ -677,21 +892,28 @@ def get_teacher_feedback(
     email: Optional[str] = Query(None),
     chapter_id: Optional[int] = Query(None),
     status: Optional[Literal["understood", "needs_review"]] = Query(None),
+    rendition: Rendition = Query("web"),
     user=Depends(get_current_user)
 ):
     if user["role"] != "teacher":
         raise HTTPException(status_code=403, detail="Access denied")
 
     query = """
-        SELECT f.id, u.email, r.chapter_id, r.video_url, f.status, f.comment, f.updated_at
+        SELECT f.id, u.email, r.chapter_id, r.video_url, f.status, f.comment, f.updated_at,
+               r.web_video_url, r.thumbnail_url
         FROM feedback f
         JOIN reflections r ON f.reflection_id = r.id
         JOIN users u ON r.user_id = u.id
-        JOIN chapters c ON r.chapter_id = c.id
-        WHERE f.teacher_id = %s AND f.obsolete = FALSE AND r.obsolete = FALSE AND c.obsolete = FALSE
+        WHERE f.teacher_id = %s AND f.obsolete = FALSE AND r.obsolete = FALSE
     """
     params = [user["user_id"]]
 
+    # Obsolete chapters come from the curriculum snapshot instead of a join
+    obsolete_chapter_ids = curriculum.get_snapshot().obsolete_chapter_ids
+    if obsolete_chapter_ids:
+        query += " AND r.chapter_id <> ALL(%s)"
+        params.append(obsolete_chapter_ids)
+
     if email:
         query += " AND u.email = %s"
         params.append(email)
@@ -704,19 +926,24 @@ def get_teacher_feedback(
 
     query += " ORDER BY f.updated_at DESC"
 
-    conn = get_db_connection()
+    conn = get_read_connection(user["user_id"])
     cur = conn.cursor()
     try:
         cur.execute(query, tuple(params))
-        return [{
-            "feedback_id": r[0],
-            "student_email": r[1],
-            "chapter_id": r[2],
-            "video_url": get_sas_url(r[3]),
-            "status": r[4],
-            "comment": r[5],
-            "updated_at": r[6].isoformat() if r[6] else None
-        } for r in cur.fetchall()]
+        results = []
+        for r in cur.fetchall():
+            video_url, thumbnail_url = signed_media(r[3], r[7], r[8], rendition)
+            results.append({
+                "feedback_id": r[0],
+                "student_email": r[1],
+                "chapter_id": r[2],
+                "video_url": video_url,
+                "thumbnail_url": thumbnail_url,
+                "status": r[4],
+                "comment": r[5],
+                "updated_at": r[6].isoformat() if r[6] else None
+            })
+        return results
     finally:
         cur.close()
         conn.close()
@@ -0,0 +1,249 @@
+"""
+Background transcoding: a compressed web rendition and a poster thumbnail
+for each submitted reflection.
+
+Jobs run on an in-process thread pool right after submission and are lost
+if the process stops. The reflection row is the durable record: anything
+still without a web rendition is picked up by ``python -m reflects.media``,
+run every few minutes by the media-backfill CronJob (k8/), which gives up
+on a reflection after TRANSCODE_MAX_ATTEMPTS failures.
+
+ffmpeg is CPU heavy, so runs are capped per pod (MEDIA_SLOTS_PER_POD)
+across all server worker processes, not just per process.
+"""
+import fcntl
+import logging
+import os
+import subprocess
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait
+from dotenv import load_dotenv
+
+from reflects.db import get_db_connection
+from reflects.storage import discard_unreferenced, get_storage, save_object, fetch_object
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+FFMPEG_BIN: str = os.getenv("FFMPEG_BIN", "ffmpeg")
+MEDIA_WORKERS: int = int(os.getenv("MEDIA_WORKERS", 2))  # queued jobs run per process
+MEDIA_SLOTS_PER_POD: int = int(os.getenv("MEDIA_SLOTS_PER_POD", 2))  # concurrent ffmpeg jobs
+MEDIA_LOCK_DIR: str = os.getenv(
+    "MEDIA_LOCK_DIR", os.path.join(tempfile.gettempdir(), "reflects-media-slots"))
+TRANSCODE_MAX_ATTEMPTS: int = int(os.getenv("TRANSCODE_MAX_ATTEMPTS", 3))
+BACKFILL_MIN_AGE: int = int(os.getenv("BACKFILL_MIN_AGE", 600))  # leave fresh uploads to the API
+WEB_RENDITION_HEIGHT: int = int(os.getenv("WEB_RENDITION_HEIGHT", 720))
+WEB_RENDITION_CRF: int = int(os.getenv("WEB_RENDITION_CRF", 28))
+THUMBNAIL_WIDTH: int = int(os.getenv("THUMBNAIL_WIDTH", 480))
+TRANSCODE_TIMEOUT: int = int(os.getenv("TRANSCODE_TIMEOUT", 900))  # seconds per ffmpeg run
+
+_executor: ThreadPoolExecutor = None
+_executor_lock = threading.Lock()
+
+
+# --- Naming ---
+def rendition_names(object_name: str) -> tuple:
+    """Return the (web rendition, thumbnail) object names derived from an original upload."""
+    base = os.path.splitext(object_name)[0]
+    return f"{base}_web.mp4", f"{base}_thumb.jpg"
+
+
+# --- ffmpeg ---
+def _ffmpeg(*args: str):
+    subprocess.run(
+        [FFMPEG_BIN, "-y", "-hide_banner", "-loglevel", "error", *args],
+        check=True,
+        timeout=TRANSCODE_TIMEOUT,
+        stdin=subprocess.DEVNULL,
+    )
+
+def transcode_web(src_path: str, dest_path: str):
+    """Transcode to a compressed H.264/AAC MP4 capped at WEB_RENDITION_HEIGHT, with faststart."""
+    _ffmpeg(
+        "-i", src_path,
+        "-vf", f"scale=-2:'min({WEB_RENDITION_HEIGHT},ih)'",
+        "-c:v", "libx264", "-preset", "veryfast", "-crf", str(WEB_RENDITION_CRF),
+        "-pix_fmt", "yuv420p",
+        "-c:a", "aac", "-b:a", "96k",
+        "-movflags", "+faststart",
+        dest_path,
+    )
+
+def extract_thumbnail(src_path: str, dest_path: str):
+    """Write a JPEG poster frame picked by ffmpeg's thumbnail filter."""
+    _ffmpeg(
+        "-i", src_path,
+        "-vf", f"thumbnail,scale={THUMBNAIL_WIDTH}:-2",
+        "-frames:v", "1",
+        "-q:v", "4",
+        dest_path,
+    )
+
+
+# --- Job ---
+def process_reflection(reflection_id: int, object_name: str):
+    """Build the web rendition and thumbnail for one reflection and record them on its row."""
+    web_name, thumb_name = rendition_names(object_name)
+    storage = get_storage()
+
+    # Content-addressed uploads share renditions, so a resubmitted video is only transcoded once
+    if not (storage.exists(web_name) and storage.exists(thumb_name)):
+        _build_renditions(object_name, web_name, thumb_name)
+
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            "UPDATE reflections SET web_video_url = %s, thumbnail_url = %s WHERE id = %s",
+            (web_name, thumb_name, reflection_id)
+        )
+        conn.commit()
+    finally:
+        cur.close()
+        conn.close()
+
+def _build_renditions(object_name: str, web_name: str, thumb_name: str):
+    """Transcode object_name and upload the web rendition and thumbnail."""
+    with tempfile.TemporaryDirectory(prefix="reflects-media-") as tmp:
+        src_path = os.path.join(tmp, "source" + os.path.splitext(object_name)[1])
+        web_path = os.path.join(tmp, "web.mp4")
+        thumb_path = os.path.join(tmp, "thumb.jpg")
+
+        fetch_object(object_name, src_path)
+        transcode_web(src_path, web_path)
+        # Decode the small rendition rather than the raw phone upload
+        extract_thumbnail(web_path, thumb_path)
+
+        with open(web_path, "rb") as f:
+            save_object(f, web_name, "video/mp4")
+        with open(thumb_path, "rb") as f:
+            save_object(f, thumb_name, "image/jpeg")
+
+def purge_media(object_keys: list):
+    """
+    Delete originals released by a committed transaction, with their renditions.
+
+    Each is re-checked under its object lock, so one uploaded again in the
+    meantime is kept.
+    """
+    if not object_keys:
+        return
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        try:
+            for object_key in object_keys:
+                discard_unreferenced(cur, object_key, rendition_names(object_key))
+                conn.commit()  # releases the object lock
+        finally:
+            cur.close()
+            conn.close()
+    except Exception:
+        logger.exception("Could not purge media objects %s", object_keys)
+
+@contextmanager
+def _pod_slot():
+    """Hold one of MEDIA_SLOTS_PER_POD lock files, shared by every process in the pod."""
+    os.makedirs(MEDIA_LOCK_DIR, exist_ok=True)
+    while True:
+        for i in range(MEDIA_SLOTS_PER_POD):
+            f = open(os.path.join(MEDIA_LOCK_DIR, f"slot-{i}.lock"), "w")
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                f.close()
+                continue
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+                f.close()
+            return
+        time.sleep(1)
+
+def _record_failure(reflection_id: int):
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            "UPDATE reflections SET transcode_attempts = transcode_attempts + 1 WHERE id = %s",
+            (reflection_id,)
+        )
+        conn.commit()
+    finally:
+        cur.close()
+        conn.close()
+
+def _run_job(reflection_id: int, object_name: str):
+    try:
+        with _pod_slot():
+            process_reflection(reflection_id, object_name)
+    except Exception:
+        # The original upload stays playable; the backfill retries the job
+        logger.exception("Transcoding failed for reflection %s (%s)", reflection_id, object_name)
+        try:
+            _record_failure(reflection_id)
+        except Exception:
+            logger.exception("Could not record transcode failure for %s", reflection_id)
+
+
+# --- Worker Pool ---
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=MEDIA_WORKERS, thread_name_prefix="media")
+        return _executor
+
+def enqueue_transcode(reflection_id: int, object_name: str):
+    """Schedule a background transcode; at most MEDIA_SLOTS_PER_POD run at once per pod."""
+    return _get_executor().submit(_run_job, reflection_id, object_name)
+
+def shutdown(wait_for_jobs: bool = True):
+    """Stop the worker pool, letting running jobs finish."""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=wait_for_jobs, cancel_futures=not wait_for_jobs)
+            _executor = None
+
+
+# --- Backfill ---
+def pending_reflections() -> list:
+    """
+    Reflections that have no web rendition yet, skipping ones that failed
+    TRANSCODE_MAX_ATTEMPTS times and uploads still within BACKFILL_MIN_AGE.
+    """
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            SELECT id, video_url FROM reflections
+            WHERE web_video_url IS NULL AND video_url IS NOT NULL AND obsolete = FALSE
+              AND transcode_attempts < %s
+              AND submitted_at < (NOW() AT TIME ZONE 'UTC') - make_interval(secs => %s)
+            ORDER BY submitted_at
+        """, (TRANSCODE_MAX_ATTEMPTS, BACKFILL_MIN_AGE))
+        return cur.fetchall()
+    finally:
+        cur.close()
+        conn.close()
+
+def backfill():
+    """Transcode every pending reflection using the bounded worker pool."""
+    futures = [enqueue_transcode(reflection_id, object_name)
+               for reflection_id, object_name in pending_reflections()]
+    wait(futures)
+    shutdown()
+    return len(futures)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    print(f"Processed {backfill()} reflections")
@@ -0,0 +1,169 @@
+"""
+Query layer: server-side prepared statements and a per-request round-trip counter.
+
+Hot statements are PREPAREd once per pooled connection (see reflects.db) and
+then run with EXECUTE, so Postgres skips parse/plan on every call. Every
+execute, commit and rollback made while handling a request is counted and
+reported in the ``X-DB-Round-Trips`` response header.
+"""
+from contextvars import ContextVar
+from typing import Optional, Sequence
+
+import psycopg2.extensions
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# --- Prepared Statements ---
+# Positional $n parameters; callers pass params in the same order.
+STATEMENTS = {
+    "user_login": "SELECT id, password, role FROM users WHERE email = $1",
+    "user_profile": "SELECT name, email FROM users WHERE id = $1",
+    "active_chapters": "SELECT id, name FROM chapters WHERE obsolete = FALSE ORDER BY id",
+    "active_subjects": "SELECT id, name FROM subjects WHERE obsolete = FALSE ORDER BY name",
+    "subject_chapters": """
+        SELECT id, name FROM chapters WHERE subject_id = $1 AND obsolete = FALSE ORDER BY id
+    """,
+    "student_emails": "SELECT DISTINCT email FROM users WHERE role = 'student'",
+    "reflection_insert": """
+        INSERT INTO reflections (user_id, chapter_id, video_url, text_summary, submitted_at)
+        VALUES ($1, $2, $3, $4, $5)
+        ON CONFLICT ON CONSTRAINT unique_user_chapter DO NOTHING
+        RETURNING id
+    """,
+    # Returns TRUE when the row was inserted rather than incremented (xmax = 0)
+    "media_acquire": """
+        INSERT INTO media_objects (object_key, ref_count, size_bytes, content_type)
+        VALUES ($1, 1, $2, $3)
+        ON CONFLICT (object_key) DO UPDATE
+        SET ref_count = media_objects.ref_count + 1,
+            content_type = COALESCE(media_objects.content_type, EXCLUDED.content_type)
+        RETURNING (xmax = 0)
+    """,
+    "media_lock": "SELECT pg_advisory_xact_lock(hashtextextended($1, 0))",
+    "media_referenced": "SELECT 1 FROM media_objects WHERE object_key = $1",
+    "media_content_type": "SELECT content_type FROM media_objects WHERE object_key = $1",
+    "feedback_upsert": """
+        INSERT INTO feedback (reflection_id, teacher_id, status, comment, updated_at)
+        VALUES ($1, $2, $3, $4, NOW())
+        ON CONFLICT (reflection_id) DO UPDATE
+        SET status = EXCLUDED.status, comment = EXCLUDED.comment, updated_at = NOW()
+    """,
+    # Creates the subject, or revives it if it was soft-deleted; no row means it is active.
+    # A change also notifies curriculum snapshot listeners (reflects.curriculum.CHANNEL).
+    "subject_upsert": """
+        WITH upserted AS (
+            INSERT INTO subjects (name) VALUES ($1)
+            ON CONFLICT (name) DO UPDATE SET obsolete = FALSE WHERE subjects.obsolete
+            RETURNING id
+        )
+        SELECT id, pg_notify('curriculum_changed', '') FROM upserted
+    """,
+    # Feedback, reflections, media references and the account in one statement.
+    # Returns (deleted user id or NULL, object keys no longer referenced).
+    # Media rows reaching zero references are deleted and the rest decremented;
+    # the two sets are disjoint because a statement may not modify a row twice.
+    "student_delete": """
+        WITH student AS (
+            SELECT id FROM users WHERE email = $1 AND role = 'student'
+        ), deleted_feedback AS (
+            DELETE FROM feedback
+            WHERE reflection_id IN (
+                SELECT r.id FROM reflections r JOIN student s ON r.user_id = s.id
+            )
+        ), deleted_reflections AS (
+            DELETE FROM reflections WHERE user_id IN (SELECT id FROM student)
+            RETURNING video_url
+        ), released AS (
+            SELECT video_url AS object_key, COUNT(*) AS n
+            FROM deleted_reflections GROUP BY video_url
+        ), purged AS (
+            DELETE FROM media_objects m USING released d
+            WHERE m.object_key = d.object_key AND m.ref_count <= d.n
+            RETURNING m.object_key
+        ), decremented AS (
+            UPDATE media_objects m SET ref_count = m.ref_count - d.n
+            FROM released d
+            WHERE m.object_key = d.object_key AND m.ref_count > d.n
+        ), deleted_user AS (
+            DELETE FROM users WHERE id IN (SELECT id FROM student) RETURNING id
+        )
+        SELECT (SELECT id FROM deleted_user), ARRAY(SELECT object_key FROM purged)
+    """,
+}
+
+def execute(cur, name: str, params: Sequence = ()):
+    """
+    Run a named statement from STATEMENTS.
+
+    The first use on a connection PREPAREs it (one extra round trip for the
+    connection's lifetime); connections outside the pool just run the SQL.
+    """
+    prepared = getattr(cur.connection, "prepared", None)
+    if prepared is None:
+        sql = STATEMENTS[name]
+        for i in range(len(params), 0, -1):
+            sql = sql.replace(f"${i}", "%s")
+        cur.execute(sql, tuple(params))
+        return
+    if name not in prepared:
+        cur.execute(f"PREPARE {name} AS {STATEMENTS[name]}")
+        prepared.add(name)
+    if params:
+        cur.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", tuple(params))
+    else:
+        cur.execute(f"EXECUTE {name}")
+
+
+# --- Round-trip counting ---
+class RoundTripCounter:
+    def __init__(self):
+        self.count = 0
+
+_counter: ContextVar[Optional[RoundTripCounter]] = ContextVar("db_round_trips", default=None)
+
+def count_round_trip():
+    counter = _counter.get()
+    if counter is not None:
+        counter.count += 1
+
+def round_trips() -> int:
+    """Round trips made so far in the current request (0 outside one)."""
+    counter = _counter.get()
+    return counter.count if counter is not None else 0
+
+class CountingCursor(psycopg2.extensions.cursor):
+    def execute(self, query, vars=None):
+        count_round_trip()
+        return super().execute(query, vars)
+
+    def executemany(self, query, vars_list):
+        count_round_trip()
+        return super().executemany(query, vars_list)
+
+    def callproc(self, procname, parameters=None):
+        count_round_trip()
+        return super().callproc(procname, parameters)
+
+class RoundTripMiddleware:
+    """Counts database round trips per request and reports them in X-DB-Round-Trips."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        counter = RoundTripCounter()
+        token = _counter.set(counter)
+
+        async def send_with_count(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                MutableHeaders(scope=message).append("X-DB-Round-Trips", str(counter.count))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_count)
+        finally:
+            _counter.reset(token)
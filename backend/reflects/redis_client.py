@@ -1,5 +1,5 @@
 import os
-import redis
+import threading
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 
@@ -7,18 +7,29 @@ from dotenv import load_dotenv
 load_dotenv()
 
 # --- Redis Connection ---
-try:
-    r = redis.Redis(
-        host=os.environ["REDIS_HOST"],
-        port=int(os.getenv("REDIS_PORT", 6380)),  # Default to 6380 for Azure Redis SSL
-        password=os.environ["REDIS_PASS"],
-        decode_responses=True,
-        ssl=True
-    )
-except KeyError as e:
-    raise RuntimeError(f"Missing required Redis env variable: {e}")
-except Exception as e:
-    raise RuntimeError(f"Failed to connect to Redis: {e}")
+_client = None
+_client_lock = threading.Lock()
+
+def get_redis():
+    """Return the shared Redis client, creating it on first use rather than at import."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                import redis
+                try:
+                    _client = redis.Redis(
+                        host=os.environ["REDIS_HOST"],
+                        port=int(os.getenv("REDIS_PORT", 6380)),  # 6380 = Azure Redis SSL
+                        password=os.environ["REDIS_PASS"],
+                        decode_responses=True,
+                        ssl=True
+                    )
+                except KeyError as e:
+                    raise RuntimeError(f"Missing required Redis env variable: {e}")
+                except Exception as e:
+                    raise RuntimeError(f"Failed to connect to Redis: {e}")
+    return _client
 
 # --- Rate Limiting ---
 RATE_LIMIT_MODE = os.environ.get("RATE_LIMIT_MODE", "fixed")  # "fixed" or "sliding"
@@ -35,6 +46,7 @@ def hybrid_rate_limiter(user_id: int, feature: str, limit: int) -> bool:
     Returns:
         True if action is allowed, False if rate-limited.
     """
+    r = get_redis()
     now = datetime.utcnow()
     date_key = now.date().isoformat()
     redis_key_fixed = f"rate:{feature}:user:{user_id}:{date_key}"
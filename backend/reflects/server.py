@@ -0,0 +1,116 @@
+"""
+Production server entrypoint: ``python -m reflects.server``.
+
+Runs the FastAPI app under gunicorn with one uvicorn worker per available
+CPU. The app is imported once in the master (preload) and workers are
+forked from it; clients (Postgres, Redis, blob storage, media pool) are
+all created lazily, so each worker builds its own pools after the fork.
+Only the route-group metric files in METRICS_DIR are shared between them.
+
+On SIGTERM the master stops accepting connections and gives workers
+GRACEFUL_TIMEOUT seconds to finish in-flight requests (uploads included)
+before exiting.
+"""
+import math
+import os
+
+from dotenv import load_dotenv
+from gunicorn.app.base import BaseApplication
+from uvicorn.workers import UvicornWorker
+
+# Load environment variables
+load_dotenv()
+
+# --- Configuration ---
+HOST: str = os.getenv("HOST", "0.0.0.0")
+PORT: int = int(os.getenv("PORT", 8000))
+WORKERS_PER_CPU: float = float(os.getenv("WORKERS_PER_CPU", 1))
+MAX_WORKERS: int = int(os.getenv("MAX_WORKERS", 16))
+KEEPALIVE: int = int(os.getenv("KEEPALIVE", 5))  # seconds an idle keep-alive connection stays open
+BACKLOG: int = int(os.getenv("BACKLOG", 2048))  # pending connections queued by the kernel
+GRACEFUL_TIMEOUT: int = int(os.getenv("GRACEFUL_TIMEOUT", 120))  # drain window on SIGTERM
+WORKER_TIMEOUT: int = int(os.getenv("WORKER_TIMEOUT", 60))  # heartbeat, not a request limit
+LIMIT_CONCURRENCY = os.getenv("LIMIT_CONCURRENCY")  # per-worker connection cap, unset = none
+
+
+def available_cpus(cgroup_root: str = "/sys/fs/cgroup") -> float:
+    """CPUs this process may use, honouring the container CPU limit (cgroup v2 or v1)."""
+    cpus = float(len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity")
+                 else os.cpu_count() or 1)
+
+    quota = period = None
+    try:
+        with open(os.path.join(cgroup_root, "cpu.max")) as f:
+            raw_quota, raw_period = f.read().split()
+        if raw_quota != "max":
+            quota, period = int(raw_quota), int(raw_period)
+    except (OSError, ValueError):
+        try:
+            with open(os.path.join(cgroup_root, "cpu", "cpu.cfs_quota_us")) as f:
+                quota = int(f.read())
+            with open(os.path.join(cgroup_root, "cpu", "cpu.cfs_period_us")) as f:
+                period = int(f.read())
+        except (OSError, ValueError):
+            quota = period = None
+
+    if quota and period and quota > 0:
+        cpus = min(cpus, quota / period)
+    return cpus
+
+def worker_count() -> int:
+    """WEB_CONCURRENCY if set, otherwise WORKERS_PER_CPU per available CPU (capped)."""
+    if os.getenv("WEB_CONCURRENCY"):
+        return max(1, int(os.environ["WEB_CONCURRENCY"]))
+    return max(1, min(MAX_WORKERS, math.ceil(available_cpus() * WORKERS_PER_CPU)))
+
+
+class ReflectsWorker(UvicornWorker):
+    """Uvicorn worker that waits for in-flight requests on shutdown."""
+    CONFIG_KWARGS = {
+        "loop": "auto",
+        "http": "auto",
+        "timeout_graceful_shutdown": GRACEFUL_TIMEOUT,
+        "limit_concurrency": int(LIMIT_CONCURRENCY) if LIMIT_CONCURRENCY else None,
+    }
+
+
+class ReflectsServer(BaseApplication):
+    def __init__(self, options: dict):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        from reflects.main import app
+        return app
+
+
+def server_options() -> dict:
+    return {
+        "bind": f"{HOST}:{PORT}",
+        "workers": worker_count(),
+        "worker_class": ReflectsWorker,
+        "preload_app": True,
+        "keepalive": KEEPALIVE,
+        "backlog": BACKLOG,
+        "graceful_timeout": GRACEFUL_TIMEOUT,
+        "timeout": WORKER_TIMEOUT,
+        # Heartbeat files in tmpfs so a slow overlay filesystem can't stall workers
+        "worker_tmp_dir": "/dev/shm" if os.path.isdir("/dev/shm") else None,
+        "accesslog": "-",
+        "errorlog": "-",
+    }
+
+def main():
+    from reflects.shedding import reset_metrics
+
+    # Metric files of the previous run's workers would otherwise count as exited workers
+    reset_metrics()
+    ReflectsServer(server_options()).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,339 @@
+"""
+Load shedding: per-route-group concurrency limits with bounded queues.
+
+Each group admits up to its concurrency limit; further requests wait in a
+queue of bounded length for at most the group's queue timeout. Anything
+beyond that is answered at once with 503 and ``Retry-After`` instead of
+piling up behind the threadpool, so a login surge cannot slow /subjects.
+
+Limits are per worker process and come from the environment, e.g.
+``SHED_LOGIN_CONCURRENCY=6 SHED_LOGIN_QUEUE=24 SHED_LOGIN_TIMEOUT=2
+SHED_LOGIN_RETRY_AFTER=2``; a concurrency of 0 disables the limit. Counters
+are exposed by render_metrics() in the Prometheus text format, added up over
+all worker processes (see WorkerMetrics).
+"""
+import asyncio
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+import time
+import uuid
+from collections import deque
+from typing import Dict, Iterable, Optional
+
+from dotenv import load_dotenv
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+# Load environment variables
+load_dotenv()
+
+# --- Configuration ---
+# group: (concurrency, queue length, queue timeout seconds, Retry-After seconds)
+# Threadpool-bound groups add up to less than its 40 threads, leaving room for
+# the rest of the app (async media streaming mostly runs off the threadpool).
+DEFAULT_LIMITS = {
+    "login": (6, 24, 2.0, 2),        # bcrypt: CPU bound
+    "upload": (4, 8, 10.0, 10),      # holds a thread for the whole upload
+    "reports": (6, 12, 5.0, 5),      # all-reflections, search, export
+    "media": (32, 64, 5.0, 2),
+    "default": (20, 80, 1.0, 1),     # cheap reads and writes
+}
+
+# (method or None for any, path prefix, group); first match wins
+ROUTE_GROUPS = [
+    (None, "/login", "login"),
+    ("POST", "/create-user", "login"),
+    ("POST", "/submit-reflection", "upload"),
+    (None, "/all-reflections", "reports"),
+    (None, "/reflections/search", "reports"),
+    (None, "/reflections/export", "reports"),
+    (None, "/media", "media"),
+]
+EXEMPT_PATHS = {"/healthz", "/metrics"}
+# Per-worker metric files; tmpfs where available
+METRICS_DIR: str = os.getenv("METRICS_DIR", os.path.join(
+    "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), "reflects-metrics"))
+
+# Per-group numbers shared through WorkerMetrics, in file order
+FIELDS = ("active", "queued", "admitted", "shed_queue_full", "shed_timeout",
+          "wait_seconds", "waits")
+GAUGE_FIELDS = {"active", "queued"}
+
+
+class RouteGroup:
+    """Concurrency slots and FIFO wait queue for one route group."""
+
+    def __init__(self, name: str, concurrency: int, queue: int,
+                 queue_timeout: float, retry_after: int,
+                 metrics: Optional["WorkerMetrics"] = None):
+        self.name = name
+        self.concurrency = concurrency
+        self.queue = queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.active = 0
+        self._waiters = deque()
+        # Metrics
+        self.admitted = 0
+        self.shed = {"queue_full": 0, "timeout": 0}
+        self.wait_seconds = 0.0
+        self.waits = 0
+        self.metrics = metrics
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    def values(self) -> tuple:
+        """Current numbers in FIELDS order."""
+        return (self.active, self.queued, self.admitted, self.shed["queue_full"],
+                self.shed["timeout"], self.wait_seconds, self.waits)
+
+    def _changed(self):
+        if self.metrics is not None:
+            self.metrics.record(self)
+
+    async def acquire(self) -> Optional[str]:
+        """Take a slot; returns None when admitted, otherwise why the request is shed."""
+        if self.concurrency <= 0 or (self.active < self.concurrency and not self._waiters):
+            self.active += 1
+            self.admitted += 1
+            self._changed()
+            return None
+        if len(self._waiters) >= self.queue:
+            self.shed["queue_full"] += 1
+            self._changed()
+            return "queue_full"
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self._changed()
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.shed["timeout"] += 1
+            return "timeout"
+        except asyncio.CancelledError:
+            # Client went away; hand on a slot we were given in the meantime
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+            self.wait_seconds += time.monotonic() - started
+            self.waits += 1
+            self._changed()
+        self.admitted += 1
+        self._changed()
+        return None
+
+    def release(self):
+        # The slot passes straight to the oldest waiter, so active stays the same
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                self._changed()
+                return
+        self.active -= 1
+        self._changed()
+
+
+class WorkerMetrics:
+    """
+    Route-group numbers of every worker process, one mmapped file each in METRICS_DIR.
+
+    A scrape reaches whichever worker accepts it, so that worker adds up all
+    the files. Files of exited workers still count towards the counters,
+    which therefore never go backwards, but not towards the gauges.
+    """
+
+    def __init__(self, names: Iterable[str], directory: str = METRICS_DIR):
+        self.names = list(names)
+        self.directory = directory
+        self._row = struct.Struct(f"{len(FIELDS)}d")
+        self._size = self._row.size * len(self.names)
+        self._offsets = {name: i * self._row.size for i, name in enumerate(self.names)}
+        self._pid = None
+        self._map = None
+
+    def _buffer(self) -> mmap.mmap:
+        # Opened on first use in each worker, after the fork
+        pid = os.getpid()
+        if self._pid != pid:
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, f"{pid}.db")
+            if os.path.exists(path):
+                # Left by an exited worker whose pid was reused; keep its counters
+                os.replace(path, os.path.join(self.directory, f"exited-{uuid.uuid4().hex}.db"))
+            with open(path, "w+b") as f:
+                f.truncate(self._size)
+                self._map = mmap.mmap(f.fileno(), self._size)
+            self._pid = pid
+        return self._map
+
+    def record(self, group: RouteGroup):
+        self._row.pack_into(self._buffer(), self._offsets[group.name], *group.values())
+
+    def collect(self) -> Dict[str, Dict[str, float]]:
+        """Totals per group over all files; gauges only from running workers."""
+        totals = {name: dict.fromkeys(FIELDS, 0.0) for name in self.names}
+        try:
+            file_names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return totals
+        for file_name in file_names:
+            if not file_name.endswith(".db"):
+                continue
+            try:
+                with open(os.path.join(self.directory, file_name), "rb") as f:
+                    data = f.read()
+            except OSError:
+                continue
+            if len(data) != self._size:
+                continue  # written by a build with other route groups
+            running = _running(file_name[:-3])
+            for name, offset in self._offsets.items():
+                for field, value in zip(FIELDS, self._row.unpack_from(data, offset)):
+                    if running or field not in GAUGE_FIELDS:
+                        totals[name][field] += value
+        return totals
+
+    def clear(self):
+        """Remove all files; the server master calls this before forking workers."""
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+def _running(pid: str) -> bool:
+    if not pid.isdigit():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def load_groups(metrics: Optional[WorkerMetrics] = None) -> Dict[str, RouteGroup]:
+    groups = {}
+    for name, (concurrency, queue, queue_timeout, retry_after) in DEFAULT_LIMITS.items():
+        prefix = f"SHED_{name.upper()}_"
+        groups[name] = RouteGroup(
+            name,
+            concurrency=int(os.getenv(prefix + "CONCURRENCY", concurrency)),
+            queue=int(os.getenv(prefix + "QUEUE", queue)),
+            queue_timeout=float(os.getenv(prefix + "TIMEOUT", queue_timeout)),
+            retry_after=int(os.getenv(prefix + "RETRY_AFTER", retry_after)),
+            metrics=metrics,
+        )
+    return groups
+
+_worker_metrics = WorkerMetrics(DEFAULT_LIMITS)
+_groups = load_groups(_worker_metrics)
+
+def reset_metrics():
+    """Start the counters from zero; for the server master, before workers exist."""
+    _worker_metrics.clear()
+
+def route_group(method: str, path: str) -> Optional[str]:
+    """Group name for a request, or None for paths that are never shed."""
+    if path in EXEMPT_PATHS:
+        return None
+    for group_method, prefix, name in ROUTE_GROUPS:
+        if group_method not in (None, method):
+            continue
+        if path == prefix or path.startswith(prefix + "/"):
+            return name
+    return "default"
+
+
+class LoadSheddingMiddleware:
+    """Admits requests per route group and sheds the excess with 503 + Retry-After."""
+
+    def __init__(self, app: ASGIApp, groups: Optional[Dict[str, RouteGroup]] = None):
+        self.app = app
+        self.groups = groups if groups is not None else _groups
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        name = route_group(scope["method"], scope["path"])
+        if name is None:
+            await self.app(scope, receive, send)
+            return
+
+        group = self.groups[name]
+        if await group.acquire() is not None:
+            response = JSONResponse(
+                {"detail": "Server is busy, please retry shortly."},
+                status_code=503,
+                headers={"Retry-After": str(group.retry_after)},
+            )
+            await response(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            group.release()
+
+
+# --- Metrics ---
+def _number(value) -> str:
+    # Shared counters come back as floats; print whole numbers without ".0"
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+def render_metrics(groups: Optional[Dict[str, RouteGroup]] = None) -> str:
+    """
+    Prometheus text exposition of route-group state.
+
+    Without groups, the numbers are the totals over all worker processes;
+    with groups, just theirs.
+    """
+    if groups is None:
+        groups = _groups
+        values = _worker_metrics.collect()
+    else:
+        values = {g.name: dict(zip(FIELDS, g.values())) for g in groups.values()}
+    lines = []
+
+    def metric(name: str, kind: str, help_text: str, samples):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            label_text = ",".join(f'{k}="{v}"' for k, v in labels.items())
+            lines.append(f"{name}{{{label_text}}} {_number(value)}")
+
+    def per_group(field: str):
+        return [({"group": name}, v[field]) for name, v in values.items()]
+
+    metric("reflects_route_group_concurrency_limit", "gauge",
+           "Requests a route group runs at once in each worker (0 = unlimited).",
+           [({"group": g.name}, g.concurrency) for g in groups.values()])
+    metric("reflects_route_group_queue_limit", "gauge",
+           "Requests a route group may queue in each worker.",
+           [({"group": g.name}, g.queue) for g in groups.values()])
+    metric("reflects_route_group_in_flight", "gauge",
+           "Requests currently running.", per_group("active"))
+    metric("reflects_route_group_queued", "gauge",
+           "Requests currently waiting for a slot.", per_group("queued"))
+    metric("reflects_route_group_admitted_total", "counter",
+           "Requests admitted.", per_group("admitted"))
+    metric("reflects_route_group_shed_total", "counter",
+           "Requests answered with 503, by reason.",
+           [({"group": name, "reason": reason}, v[f"shed_{reason}"])
+            for name, v in values.items() for reason in ("queue_full", "timeout")])
+    lines.append("# HELP reflects_route_group_queue_wait_seconds Time spent queued.")
+    lines.append("# TYPE reflects_route_group_queue_wait_seconds summary")
+    for name, v in values.items():
+        lines.append(f'reflects_route_group_queue_wait_seconds_sum{{group="{name}"}} '
+                     f"{v['wait_seconds']:.6f}")
+        lines.append(f'reflects_route_group_queue_wait_seconds_count{{group="{name}"}} '
+                     f"{_number(v['waits'])}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,268 @@
+import hashlib
+import hmac
+import logging
+import os
+import re
+import secrets
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+from urllib.parse import quote
+from dotenv import load_dotenv
+
+from reflects import queries
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# ----- Environment Config -----
+ENV = os.getenv("ENV", "local")
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "azure" if ENV == "production" else "local")
+AZURE_CONTAINER = os.getenv("AZURE_STORAGE_CONTAINER_NAME", "uploads")
+AZURE_CONN_STR = os.getenv("AZURE_STORAGE_CONNECTION_STRING")
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploads")
+MEDIA_URL_PREFIX = os.getenv("MEDIA_URL_PREFIX", "/media")
+MEDIA_SIGNING_KEY = os.getenv("MEDIA_SIGNING_KEY")  # required for local storage in production
+# Development fallback, made at import so preloaded server workers share it
+_DEV_SIGNING_KEY = secrets.token_hex(32)
+MEDIA_URL_TTL = int(os.getenv("MEDIA_URL_TTL", 3600))  # seconds, matches the Azure SAS expiry
+HASH_CHUNK_SIZE = 1024 * 1024
+DEFAULT_VIDEO_TYPE = "video/mp4"  # originals stored before content types were recorded
+
+
+# ----- Backend Interface -----
+class StorageBackend:
+    """Where reflection videos and their renditions are kept."""
+
+    def save(self, fileobj, key: str, content_type: Optional[str] = None):
+        raise NotImplementedError
+
+    def fetch(self, key: str, dest_path: str):
+        raise NotImplementedError
+
+    def exists(self, key: str) -> bool:
+        raise NotImplementedError
+
+    def delete(self, key: str):
+        raise NotImplementedError
+
+    def url(self, key: str, expires_in: int = MEDIA_URL_TTL) -> str:
+        """Time-limited read URL for the object."""
+        raise NotImplementedError
+
+
+# ----- Azure Blob Storage -----
+class AzureBlobBackend(StorageBackend):
+    def __init__(self, conn_str: Optional[str] = AZURE_CONN_STR, container: str = AZURE_CONTAINER):
+        # The Azure SDK is slow to import; only deployments using it pay for it
+        from azure.storage.blob import BlobServiceClient
+
+        self.service = BlobServiceClient.from_connection_string(conn_str)
+        self.container = container
+
+    def _blob(self, key: str):
+        return self.service.get_blob_client(container=self.container, blob=key)
+
+    def save(self, fileobj, key: str, content_type: Optional[str] = None):
+        from azure.storage.blob import ContentSettings
+
+        settings = ContentSettings(content_type=content_type) if content_type else None
+        try:
+            self._blob(key).upload_blob(fileobj, overwrite=True, content_settings=settings)
+        except Exception as e:
+            raise Exception(f"Azure upload failed: {str(e)}")
+
+    def fetch(self, key: str, dest_path: str):
+        try:
+            with open(dest_path, "wb") as f:
+                self._blob(key).download_blob().readinto(f)
+        except Exception as e:
+            raise Exception(f"Azure download failed: {str(e)}")
+
+    def exists(self, key: str) -> bool:
+        return self._blob(key).exists()
+
+    def delete(self, key: str):
+        self._blob(key).delete_blob(delete_snapshots="include")
+
+    def url(self, key: str, expires_in: int = MEDIA_URL_TTL) -> str:
+        from azure.storage.blob import generate_blob_sas, BlobSasPermissions
+
+        blob_client = self._blob(key)
+
+        # Get the storage account key from an env variable
+        account_key = os.getenv("AZURE_STORAGE_ACCOUNT_KEY")
+        if not account_key:
+            raise RuntimeError("AZURE_STORAGE_ACCOUNT_KEY is not set in environment variables.")
+
+        sas_token = generate_blob_sas(
+            account_name=blob_client.account_name,
+            container_name=blob_client.container_name,
+            blob_name=key,
+            account_key=account_key,
+            permission=BlobSasPermissions(read=True),
+            expiry=datetime.utcnow() + timedelta(seconds=expires_in)
+        )
+        return f"{blob_client.url}?{sas_token}"
+
+
+# ----- Local Filesystem -----
+class LocalFileBackend(StorageBackend):
+    """Files under a directory, served by the /media route with HMAC-signed expiring URLs."""
+
+    def __init__(self, root: str = UPLOAD_DIR, url_prefix: str = MEDIA_URL_PREFIX,
+                 signing_key: Optional[str] = None):
+        self.root = os.path.abspath(root)
+        self.url_prefix = url_prefix.rstrip("/")
+        signing_key = signing_key or MEDIA_SIGNING_KEY
+        if not signing_key:
+            if ENV == "production":
+                raise RuntimeError("MEDIA_SIGNING_KEY must be set for local storage in production")
+            # Dev only: URLs stop verifying after a restart
+            logger.warning("MEDIA_SIGNING_KEY is not set; signing media URLs with a random key")
+            signing_key = _DEV_SIGNING_KEY
+        self.signing_key = signing_key.encode()
+
+    def path(self, key: str) -> str:
+        """Absolute path for key, refusing anything that escapes the storage root."""
+        path = os.path.abspath(os.path.join(self.root, key))
+        if os.path.commonpath([self.root, path]) != self.root or path == self.root:
+            raise ValueError(f"Invalid storage key: {key}")
+        return path
+
+    def save(self, fileobj, key: str, content_type: Optional[str] = None):
+        # The /media route looks content types up in media_objects
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write then rename so readers never see a half-written file
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                shutil.copyfileobj(fileobj, f, 1024 * 1024)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def fetch(self, key: str, dest_path: str):
+        shutil.copyfile(self.path(key), dest_path)
+
+    def exists(self, key: str) -> bool:
+        return os.path.isfile(self.path(key))
+
+    def delete(self, key: str):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def sign(self, key: str, expires: int) -> str:
+        message = f"{key}\n{expires}".encode()
+        return hmac.new(self.signing_key, message, hashlib.sha256).hexdigest()
+
+    def verify(self, key: str, expires: int, sig: str) -> bool:
+        if expires < time.time():
+            return False
+        return hmac.compare_digest(self.sign(key, expires), sig)
+
+    def url(self, key: str, expires_in: int = MEDIA_URL_TTL) -> str:
+        expires = int(time.time()) + expires_in
+        return f"{self.url_prefix}/{quote(key)}?expires={expires}&sig={self.sign(key, expires)}"
+
+
+_storage: Optional[StorageBackend] = None
+
+def get_storage() -> StorageBackend:
+    """The configured backend (STORAGE_BACKEND=azure|local), created on first use."""
+    global _storage
+    if _storage is None:
+        if STORAGE_BACKEND == "azure":
+            _storage = AzureBlobBackend()
+        elif STORAGE_BACKEND == "local":
+            _storage = LocalFileBackend()
+        else:
+            raise ValueError(f"Invalid STORAGE_BACKEND: {STORAGE_BACKEND}")
+    return _storage
+
+
+# ----- Helpers used by routes and workers -----
+def get_sas_url(blob_name: str):
+    return get_storage().url(blob_name)
+
+def save_object(fileobj, object_name: str, content_type: Optional[str] = None):
+    """Store a file object under object_name in the configured backend."""
+    get_storage().save(fileobj, object_name, content_type)
+
+def fetch_object(object_name: str, dest_path: str):
+    """Copy a stored object to a local path."""
+    get_storage().fetch(object_name, dest_path)
+
+
+# ----- Content-addressed objects -----
+def hash_file(fileobj) -> tuple:
+    """SHA-256 hex digest and size of a seekable file, read in chunks and rewound."""
+    fileobj.seek(0)
+    digest = hashlib.sha256()
+    size = 0
+    for chunk in iter(lambda: fileobj.read(HASH_CHUNK_SIZE), b""):
+        digest.update(chunk)
+        size += len(chunk)
+    fileobj.seek(0)
+    return digest.hexdigest(), size
+
+def content_key(digest: str) -> str:
+    """
+    Storage key for content with the given digest.
+
+    The upload's file name plays no part: the same bytes sent as a.mp4 and
+    a.MOV are one object with one reference count and one set of renditions.
+    """
+    return f"videos/{digest}"
+
+def video_content_type(declared: Optional[str]) -> Optional[str]:
+    """The upload's declared type if it is a video/* type; we serve nothing else as the original."""
+    media_type = (declared or "").split(";")[0].strip().lower()
+    return media_type if re.fullmatch(r"video/[\w.+-]+", media_type) else None
+
+def lock_object(cur, key: str):
+    """
+    Serialize storing and deleting the object until the caller's transaction ends.
+
+    Deletes drop the media_objects row first and the file later, so whether
+    a file may be deleted, or must be uploaded again, is decided under this
+    lock and never from storage.exists().
+    """
+    queries.execute(cur, "media_lock", (key,))
+
+def acquire_object(cur, key: str, size_bytes: Optional[int] = None,
+                   content_type: Optional[str] = None) -> bool:
+    """
+    Add a reference to an object inside the caller's transaction, under lock_object().
+
+    Returns True when the object had no references: the caller must store
+    it before committing, even if a file is still there.
+    """
+    queries.execute(cur, "media_acquire", (key, size_bytes, content_type))
+    return cur.fetchone()[0]
+
+def discard_unreferenced(cur, key: str, renditions: tuple = ()) -> bool:
+    """
+    Delete an object and its renditions unless a media_objects row references it.
+
+    Takes lock_object(); the caller ends the transaction afterwards.
+    """
+    lock_object(cur, key)
+    queries.execute(cur, "media_referenced", (key,))
+    if cur.fetchone() is not None:
+        return False
+    storage = get_storage()
+    for name in (key, *renditions):
+        try:
+            storage.delete(name)
+        except Exception:
+            logger.exception("Failed to delete stored object %s", name)
+    return True
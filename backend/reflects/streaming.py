@@ -0,0 +1,106 @@
+import os
+import re
+from typing import Optional, Tuple
+
+import anyio
+from starlette.responses import FileResponse
+from starlette.types import Receive, Scope, Send
+
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single-range Range header into an inclusive (start, end) pair.
+
+    Returns None when the whole file should be sent (no header, multiple
+    ranges or an unknown unit) and raises ValueError when the range cannot
+    be satisfied.
+    """
+    if not header:
+        return None
+    match = _RANGE_RE.match(header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if first == "" and last == "":
+        return None
+    if first == "":
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0 or size == 0:
+            raise ValueError("Unsatisfiable range")
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError("Unsatisfiable range")
+    return start, end
+
+
+class RangeFileResponse(FileResponse):
+    """
+    FileResponse with HTTP Range support for video seeking.
+
+    Bodies go out through the ASGI ``http.response.zerocopysend`` extension
+    (kernel ``sendfile``) when the server offers it, and as chunked reads
+    otherwise.
+    """
+    chunk_size = 256 * 1024
+
+    def __init__(self, path: str, range_header: Optional[str] = None, **kwargs):
+        stat_result = os.stat(path)
+        super().__init__(path, stat_result=stat_result, **kwargs)
+        size = stat_result.st_size
+        self.headers["accept-ranges"] = "bytes"
+        self.start, self.end = 0, size - 1
+        try:
+            byte_range = parse_range(range_header, size)
+        except ValueError:
+            self.status_code = 416
+            self.headers["content-range"] = f"bytes */{size}"
+            self.headers["content-length"] = "0"
+            self.start, self.end = 0, -1
+            return
+        if byte_range is not None:
+            self.start, self.end = byte_range
+            self.status_code = 206
+            self.headers["content-range"] = f"bytes {self.start}-{self.end}/{size}"
+            self.headers["content-length"] = str(self.end - self.start + 1)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({
+            "type": "http.response.start",
+            "status": self.status_code,
+            "headers": self.raw_headers,
+        })
+        count = self.end - self.start + 1
+        if scope["method"].upper() == "HEAD" or count <= 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        elif "http.response.zerocopysend" in scope.get("extensions", {}):
+            with open(self.path, "rb") as file:
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": file.fileno(),
+                    "offset": self.start,
+                    "count": count,
+                })
+        else:
+            async with await anyio.open_file(self.path, mode="rb") as file:
+                await file.seek(self.start)
+                remaining = count
+                while remaining > 0:
+                    chunk = await file.read(min(self.chunk_size, remaining))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    await send({
+                        "type": "http.response.body",
+                        "body": chunk,
+                        "more_body": remaining > 0,
+                    })
+                if remaining > 0:
+                    # File shrank underneath us; close the body rather than hang
+                    await send({"type": "http.response.body", "body": b"", "more_body": False})
+        if self.background is not None:
+            await self.background()
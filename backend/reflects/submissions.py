@@ -0,0 +1,350 @@
+"""
+Reflection submission: the shared store-and-insert step plus a Redis-backed
+queue so /submit-reflection can answer 202 before the video reaches storage.
+
+Spooled uploads live on this node's disk, so each node (SPOOL_NODE, the pod
+hostname by default) consumes its own queue. On shutdown the consumers keep
+going until that queue is empty, within the server's graceful drain window.
+"""
+import logging
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Optional
+from dotenv import load_dotenv
+
+from reflects import queries
+from reflects.db import get_db_connection, mark_recent_write
+from reflects.media import enqueue_transcode
+from reflects.redis_client import get_redis
+from reflects.storage import (
+    acquire_object, content_key, discard_unreferenced, hash_file, lock_object, save_object,
+    video_content_type,
+)
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+SUBMIT_MODE: str = os.getenv("REFLECTION_SUBMIT_MODE", "sync")  # default for /submit-reflection
+SPOOL_DIR: str = os.getenv("SPOOL_DIR", os.path.join(tempfile.gettempdir(), "reflects-spool"))
+SPOOL_NODE: str = os.getenv("SPOOL_NODE", socket.gethostname())
+JOB_WORKERS: int = int(os.getenv("REFLECTION_JOB_WORKERS", 2))
+JOB_TTL: int = int(os.getenv("REFLECTION_JOB_TTL", 86400))  # seconds job status is kept
+# A pending job untouched this long is treated as lost with its pod (its spool
+# and queue are node-local); a resubmission then replaces it
+JOB_STALE_AFTER: int = int(os.getenv("REFLECTION_JOB_STALE_AFTER", 1800))
+PENDING_STATUSES = ("receiving", "queued", "processing")
+QUEUE_RETRY_AFTER: int = int(os.getenv("REFLECTION_QUEUE_RETRY_AFTER", 5))  # 503 Retry-After
+
+QUEUE_KEY = f"queue:reflections:{SPOOL_NODE}"
+
+
+class QueueUnavailable(Exception):
+    """The submission could not be queued right now (Redis down or contended); retry later."""
+
+
+# --- Store + insert ---
+def create_reflection(user_id: int, chapter_id: int, text_summary: Optional[str],
+                      fileobj, content_type: Optional[str] = None) -> Optional[int]:
+    """
+    Store the video and insert the reflection row.
+
+    content_type is the type the client declared; it is recorded, and the
+    video served with it, only if it is a video/* type.
+
+    Returns the new reflection id, or None when the user already has a
+    reflection for this chapter (unique_user_chapter).
+    """
+    # Identical retries/resubmissions share one stored object instead of re-uploading
+    digest, size_bytes = hash_file(fileobj)
+    object_key = content_key(digest)
+
+    reflection_id = _insert_reflection(user_id, chapter_id, text_summary, fileobj,
+                                       object_key, size_bytes, video_content_type(content_type))
+    if reflection_id is None:
+        return None
+
+    mark_recent_write(user_id)
+    enqueue_transcode(reflection_id, object_key)
+    return reflection_id
+
+def _insert_reflection(user_id: int, chapter_id: int, text_summary: Optional[str],
+                       fileobj, object_key: str, size_bytes: int,
+                       content_type: Optional[str]) -> Optional[int]:
+    """Insert the row and reference the object, uploading it only if it had no references."""
+    conn = get_db_connection()
+    cur = conn.cursor()
+    uploaded = False
+    try:
+        queries.execute(cur, "reflection_insert", (
+            user_id, chapter_id, object_key, text_summary.strip() if text_summary else None,
+            datetime.utcnow()
+        ))
+        row = cur.fetchone()
+        if row is None:
+            conn.rollback()
+            return None
+        # Held until commit, so a purge of the same content cannot delete the file
+        # between this reference and the upload
+        lock_object(cur, object_key)
+        if acquire_object(cur, object_key, size_bytes, content_type):
+            save_object(fileobj, object_key, content_type)
+            uploaded = True
+        conn.commit()
+        return row[0]
+    except Exception:
+        try:
+            conn.rollback()
+        finally:
+            # After the rollback, which releases the object lock the discard takes
+            if uploaded:
+                # Nothing references the upload we just wrote; don't leave it behind
+                _discard_upload(object_key)
+        raise
+    finally:
+        cur.close()
+        conn.close()
+
+def _discard_upload(object_key: str):
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        try:
+            discard_unreferenced(cur, object_key)
+            conn.commit()
+        finally:
+            cur.close()
+            conn.close()
+    except Exception:
+        logger.exception("Could not discard unreferenced object %s", object_key)
+
+
+# --- Job records ---
+def _job_key(job_id: str) -> str:
+    return f"job:reflection:{job_id}"
+
+def _dedupe_key(user_id: int, chapter_id: int) -> str:
+    return f"job:reflection:user:{user_id}:chapter:{chapter_id}"
+
+def _set_status(job_id: str, **fields):
+    r = get_redis()
+    fields["updated_at"] = int(time.time())
+    r.hset(_job_key(job_id), mapping={k: "" if v is None else v for k, v in fields.items()})
+    r.expire(_job_key(job_id), JOB_TTL)
+
+def get_job(job_id: str) -> Optional[dict]:
+    job = get_redis().hgetall(_job_key(job_id))
+    return job or None
+
+def _abandoned(job: dict) -> bool:
+    """Pending, but not updated for JOB_STALE_AFTER seconds: its pod is gone."""
+    if job.get("status") not in PENDING_STATUSES:
+        return False
+    return time.time() - int(job.get("updated_at") or 0) > JOB_STALE_AFTER
+
+# Replace (or, with an empty new value, delete) the marker only if it still
+# names the expected job, so racing requests cannot clobber each other.
+_SWAP_MARKER = """
+if redis.call('get', KEYS[1]) ~= ARGV[1] then
+    return 0
+end
+if ARGV[2] == '' then
+    redis.call('del', KEYS[1])
+else
+    redis.call('set', KEYS[1], ARGV[2], 'EX', ARGV[3])
+end
+return 1
+"""
+
+def _claim_marker(r, dedupe_key: str, job_id: str) -> str:
+    """Point the dedupe marker at job_id unless another job holds it; returns the holder."""
+    for _ in range(3):
+        if r.set(dedupe_key, job_id, nx=True, ex=JOB_TTL):
+            return job_id
+        existing = r.get(dedupe_key)
+        if existing is None:
+            continue  # expired in between
+        job = get_job(existing)
+        if job and not _abandoned(job):
+            return existing
+        # The marker outlived its job, or the job died with its pod; take it
+        # over unless someone else just did
+        if r.eval(_SWAP_MARKER, 1, dedupe_key, existing, job_id, JOB_TTL):
+            if job:
+                _set_status(existing, status="failed",
+                            error="Abandoned: the server handling it stopped.")
+            return job_id
+    raise QueueUnavailable("Could not queue the submission, please try again.")
+
+def _release_marker(r, user_id: int, chapter_id: int, job_id: str):
+    """Let the student submit again, unless a newer job has already taken the marker."""
+    r.eval(_SWAP_MARKER, 1, _dedupe_key(user_id, chapter_id), job_id, "", 0)
+
+def enqueue_submission(user_id: int, chapter_id: int, text_summary: Optional[str],
+                       fileobj, content_type: Optional[str] = None) -> str:
+    """
+    Spool the upload and queue it for storage + insert; returns the job id.
+
+    A second submission for the same user and chapter while the first is
+    pending (or after it succeeded) returns the existing job instead of
+    queueing another upload; a pending job older than JOB_STALE_AFTER is
+    replaced instead. Raises QueueUnavailable when Redis fails.
+    """
+    from redis.exceptions import RedisError
+
+    try:
+        return _enqueue_submission(user_id, chapter_id, text_summary, fileobj, content_type)
+    except RedisError as e:
+        logger.warning("Could not queue a reflection submission: %s", e)
+        raise QueueUnavailable("Could not queue the submission, please try again.") from e
+
+def _enqueue_submission(user_id: int, chapter_id: int, text_summary: Optional[str],
+                        fileobj, content_type: Optional[str]) -> str:
+    r = get_redis()
+    job_id = uuid.uuid4().hex
+    # The record exists before the marker names it, so a concurrent duplicate
+    # that finds the marker always finds the job behind it
+    _set_status(job_id, **{
+        "status": "receiving",
+        "user_id": user_id,
+        "chapter_id": chapter_id,
+        "text_summary": text_summary,
+        "content_type": content_type,
+        "created_at": datetime.utcnow().isoformat(),
+    })
+    owner = _claim_marker(r, _dedupe_key(user_id, chapter_id), job_id)
+    if owner != job_id:
+        r.delete(_job_key(job_id))
+        return owner
+
+    os.makedirs(SPOOL_DIR, exist_ok=True)
+    spool_path = os.path.join(SPOOL_DIR, job_id)
+    try:
+        with open(spool_path, "wb") as f:
+            shutil.copyfileobj(fileobj, f, 1024 * 1024)
+    except BaseException:
+        # Upload interrupted: nothing to queue
+        _set_status(job_id, status="failed", error="Upload interrupted.")
+        _release_marker(r, user_id, chapter_id, job_id)
+        try:
+            os.remove(spool_path)
+        except OSError:
+            pass
+        raise
+
+    try:
+        _set_status(job_id, status="queued", spool_path=spool_path)
+        r.lpush(QUEUE_KEY, job_id)
+    except BaseException:
+        # Not queued: free the marker so the client's retry starts over
+        _remove_spool({"spool_path": spool_path})
+        try:
+            _release_marker(r, user_id, chapter_id, job_id)
+        except Exception:
+            logger.warning("Could not release the submission marker for job %s", job_id)
+        raise
+    start_workers()
+    return job_id
+
+
+# --- Worker ---
+def process_job(job_id: str):
+    job = get_job(job_id)
+    if not job:
+        return
+    if job.get("status") != "queued":
+        # Replaced by a resubmission after it was given up for lost
+        _remove_spool(job)
+        return
+    user_id, chapter_id = int(job["user_id"]), int(job["chapter_id"])
+    _set_status(job_id, status="processing")
+    try:
+        with open(job["spool_path"], "rb") as f:
+            reflection_id = create_reflection(
+                user_id, chapter_id, job["text_summary"] or None, f,
+                job.get("content_type") or None
+            )
+        if reflection_id is None:
+            _set_status(job_id, status="duplicate", error="Already submitted for this chapter.")
+        else:
+            _set_status(job_id, status="done", reflection_id=reflection_id)
+    except Exception as e:
+        logger.exception("Reflection job %s failed", job_id)
+        _set_status(job_id, status="failed", error=str(e))
+        # Let the student try again
+        _release_marker(get_redis(), user_id, chapter_id, job_id)
+    finally:
+        _remove_spool(job)
+
+def _remove_spool(job: dict):
+    try:
+        os.remove(job["spool_path"])
+    except (KeyError, OSError):
+        pass
+
+def _consume(stop: threading.Event):
+    r = get_redis()
+    while True:
+        try:
+            if stop.is_set():
+                # Draining: finish what is queued on this node, then exit
+                job_id = r.rpop(QUEUE_KEY)
+                if job_id is None:
+                    return
+            else:
+                item = r.brpop([QUEUE_KEY], timeout=1)
+                if item is None:
+                    continue
+                job_id = item[1]
+            process_job(job_id)
+        except Exception:
+            logger.exception("Reflection queue consumer error")
+            if stop.wait(1):
+                return
+
+
+_threads: list = []
+_stop = threading.Event()
+
+_threads_lock = threading.Lock()
+
+def start_workers():
+    """Start JOB_WORKERS consumer threads for this process (after fork); no-op if running."""
+    with _threads_lock:
+        if _threads:
+            return
+        _stop.clear()
+        for i in range(JOB_WORKERS):
+            thread = threading.Thread(target=_consume, args=(_stop,),
+                                      name=f"reflection-jobs-{i}", daemon=True)
+            thread.start()
+            _threads.append(thread)
+
+def stop_workers(timeout: Optional[float] = None):
+    """Drain this node's queue and stop the consumers."""
+    _stop.set()
+    with _threads_lock:
+        for thread in _threads:
+            thread.join(timeout)
+        _threads.clear()
+
+
+def job_status(job_id: str) -> dict:
+    """Public view of a job record."""
+    job = get_job(job_id) or {}
+    return {
+        "job_id": job_id,
+        "status": job.get("status"),
+        "chapter_id": int(job["chapter_id"]) if job.get("chapter_id") else None,
+        "reflection_id": int(job["reflection_id"]) if job.get("reflection_id") else None,
+        "error": job.get("error") or None,
+        "created_at": job.get("created_at"),
+    }
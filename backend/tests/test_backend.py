@@ -1,5 +1,7 @@
 import pytest
 from fastapi.testclient import TestClient
+from reflects import queries
+from reflects.db import get_db_connection
 from reflects.main import app
 
 client = TestClient(app)
@@ -72,3 +74,71 @@ def test_teacher_feedback_post_invalid(auth_header):
     }
     response = client.post("/teacher/feedback", json=data, headers=auth_header)
     assert response.status_code in [200, 400, 403]
+
+def test_search_reflections(auth_header):
+    response = client.get("/reflections/search", params={"q": "photosynthesis"},
+                          headers=auth_header)
+    assert response.status_code in [200, 403]
+    if response.status_code == 200:
+        assert isinstance(response.json(), list)
+
+def test_search_reflections_requires_query(auth_header):
+    response = client.get("/reflections/search", headers=auth_header)
+    assert response.status_code == 422
+
+def test_feedback_writes_keep_search_vector_current():
+    """The migrations/003 triggers; everything is rolled back."""
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            INSERT INTO users (name, email, password, role)
+            VALUES ('Search Test', 'search-vector-test@example.com', 'x', 'student') RETURNING id
+        """)
+        user_id = cur.fetchone()[0]
+        cur.execute("SELECT id FROM chapters LIMIT 1")
+        chapter = cur.fetchone()
+        if chapter is None:
+            pytest.skip("No chapters in the test database")
+        cur.execute("""
+            INSERT INTO reflections (user_id, chapter_id, video_url, text_summary)
+            VALUES (%s, %s, 'videos/search-test', 'Notes on photosynthesis') RETURNING id
+        """, (user_id, chapter[0]))
+        reflection_id = cur.fetchone()[0]
+
+        def matches(word):
+            cur.execute("SELECT search_vector @@ to_tsquery('english', %s) FROM reflections"
+                        " WHERE id = %s", (word, reflection_id))
+            return cur.fetchone()[0]
+
+        assert matches("photosynthesis") and not matches("chlorophyll")
+        queries.execute(cur, "feedback_upsert",
+                        (reflection_id, None, "understood", "Mention chlorophyll"))
+        assert matches("chlorophyll")
+        queries.execute(cur, "feedback_upsert",
+                        (reflection_id, None, "understood", "Mention mitochondria"))
+        assert matches("mitochondria") and not matches("chlorophyll")
+        cur.execute("UPDATE feedback SET obsolete = TRUE WHERE reflection_id = %s",
+                    (reflection_id,))
+        assert not matches("mitochondria")
+        cur.execute("UPDATE feedback SET obsolete = FALSE WHERE reflection_id = %s",
+                    (reflection_id,))
+        assert matches("mitochondria")
+        cur.execute("DELETE FROM feedback WHERE reflection_id = %s", (reflection_id,))
+        assert not matches("mitochondria") and matches("photosynthesis")
+    finally:
+        conn.rollback()
+        cur.close()
+        conn.close()
+
+def test_export_reflections_csv(auth_header):
+    response = client.get("/reflections/export", params={"format": "csv"}, headers=auth_header)
+    assert response.status_code in [200, 403]
+    if response.status_code == 200:
+        assert response.headers["content-type"].startswith("text/csv")
+        assert response.text.startswith("id,email,subject_id,")
+
+def test_metrics_only_served_to_direct_scrapes():
+    assert client.get("/metrics").status_code == 200
+    forwarded = client.get("/metrics", headers={"X-Forwarded-For": "203.0.113.7"})
+    assert forwarded.status_code == 404
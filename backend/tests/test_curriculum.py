@@ -0,0 +1,73 @@
+from types import SimpleNamespace
+
+import pytest
+
+from reflects import curriculum
+
+ROWS = [
+    (1, "Biology", False, 10, "Cells", False),
+    (1, "Biology", False, 11, "Plants", True),
+    (2, "History", True, 20, "Rome", False),
+    (3, "Empty", False, None, None, None),
+]
+
+
+@pytest.fixture
+def loads(monkeypatch):
+    """Serve ROWS instead of the database and count reloads."""
+    state = SimpleNamespace(rows=list(ROWS), loads=0)
+
+    def load(conn):
+        state.loads += 1
+        return curriculum.Snapshot.from_rows(state.rows)
+
+    class Conn:
+        autocommit = False
+
+        def close(self):
+            pass
+
+    monkeypatch.setattr(curriculum, "load", load)
+    monkeypatch.setattr(curriculum, "get_db_connection", Conn)
+    monkeypatch.setattr(curriculum, "start_listener", lambda: None)
+    monkeypatch.setattr(curriculum, "_snapshot", None)
+    monkeypatch.setattr(curriculum, "_stale", True)
+    return state
+
+
+def test_snapshot_from_rows():
+    snapshot = curriculum.Snapshot.from_rows(ROWS)
+    assert set(snapshot.subjects) == {1, 2, 3}
+    assert snapshot.chapter_ids(1) == [10, 11]
+    assert snapshot.chapter_ids(3) == []
+    # Obsolete chapter, and a live chapter under an obsolete subject
+    assert snapshot.obsolete_chapter_ids == [11, 20]
+    assert snapshot.describe(20) == {
+        "subject_id": 2,
+        "chapter_name": "Rome",
+        "subject_name": "History",
+        "chapter_obsolete": False,
+        "subject_obsolete": True,
+    }
+
+def test_get_snapshot_reuses_until_invalidated(loads):
+    first = curriculum.get_snapshot()
+    assert curriculum.get_snapshot() is first
+    assert loads.loads == 1
+
+    curriculum.invalidate()
+    assert curriculum.get_snapshot() is not first
+    assert loads.loads == 2
+
+def test_get_snapshot_reloads_for_unknown_chapter(loads):
+    curriculum.get_snapshot()
+    loads.rows.append((1, "Biology", False, 12, "Animals", False))
+    snapshot = curriculum.get_snapshot([10, 12])
+    assert snapshot.describe(12)["chapter_name"] == "Animals"
+    assert loads.loads == 2
+
+def test_get_snapshot_reloads_when_old(loads, monkeypatch):
+    curriculum.get_snapshot()
+    monkeypatch.setattr(curriculum, "CURRICULUM_MAX_AGE", -1)
+    curriculum.get_snapshot()
+    assert loads.loads == 2
@@ -0,0 +1,129 @@
+import itertools
+
+import psycopg2
+import pytest
+
+from reflects import db
+
+
+class FakeCursor:
+    def __init__(self, lag):
+        self.lag = lag
+
+    def execute(self, query, params=None):
+        pass
+
+    def fetchone(self):
+        return (self.lag,)
+
+    def close(self):
+        pass
+
+class FakeConnection:
+    def __init__(self, name, lag=0):
+        self.name = name
+        self.lag = lag
+        self.closed = False
+
+    def cursor(self):
+        return FakeCursor(self.lag)
+
+    def set_session(self, **kwargs):
+        self.session = kwargs
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def replicas(monkeypatch):
+    """Two replicas plus a primary; returns the per-DSN behaviour table tests can edit."""
+    behaviour = {"replica-a": 0, "replica-b": 0}
+
+    def connect(dsn=None, **kwargs):
+        if dsn is None:
+            return FakeConnection("primary")
+        if behaviour[dsn] == "down":
+            raise psycopg2.OperationalError("connection refused")
+        return FakeConnection(dsn, lag=behaviour[dsn])
+
+    pool = [db.Replica(dsn) for dsn in behaviour]
+    monkeypatch.setattr(db, "_replicas", pool)
+    monkeypatch.setattr(db, "_replica_counter", itertools.count())
+    monkeypatch.setattr(db.psycopg2, "connect", connect)
+    monkeypatch.setattr(db, "_primary_pool", db.ConnectionPool(db._connect_primary))
+    monkeypatch.setattr(db, "has_recent_write", lambda user_id: user_id == 42)
+    for key in ("DB_HOST", "DB_NAME", "DB_USER", "DB_PASS", "DB_PORT"):
+        monkeypatch.setenv(key, "x")
+    return behaviour
+
+def test_reads_round_robin_over_replicas(replicas):
+    names = [db.get_read_connection(1).name for _ in range(4)]
+    assert names == ["replica-a", "replica-b", "replica-a", "replica-b"]
+
+def test_recent_writer_reads_from_primary(replicas):
+    assert db.get_read_connection(42).name == "primary"
+
+def test_down_replica_is_skipped(replicas):
+    replicas["replica-a"] = "down"
+    names = {db.get_read_connection(1).name for _ in range(4)}
+    assert names == {"replica-b"}
+
+def test_lagging_replicas_fall_back_to_primary(replicas):
+    replicas["replica-a"] = replicas["replica-b"] = db.REPLICA_MAX_LAG_SECONDS + 1
+    assert db.get_read_connection(1).name == "primary"
+
+
+class PingCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, query, params=None):
+        if self.conn.dead:
+            raise psycopg2.OperationalError("server closed the connection unexpectedly")
+        self.conn.pings += 1
+
+    def close(self):
+        pass
+
+class IdleConnection:
+    def __init__(self):
+        self.closed = False
+        self.autocommit = False
+        self.dead = False
+        self.pings = 0
+        self.released_at = 0.0
+
+    def cursor(self):
+        return PingCursor(self)
+
+    def discard(self):
+        self.closed = True
+
+def test_checkout_pings_idle_connections():
+    pool = db.ConnectionPool(IdleConnection)
+    conn = pool.acquire()
+    pool._idle.append(conn)
+    assert pool.acquire() is conn
+    assert conn.pings == 1 and conn.autocommit is False
+
+    # Recently used connections are handed out without a ping
+    conn.released_at = db.time.monotonic()
+    pool._idle.append(conn)
+    assert pool.acquire() is conn
+    assert conn.pings == 1
+
+def test_failed_ping_discards_idle_connections():
+    pool = db.ConnectionPool(IdleConnection)
+    fresh, dead = IdleConnection(), IdleConnection()
+    fresh.released_at = db.time.monotonic()
+    dead.dead = True
+    pool._idle.extend([fresh, dead])
+
+    conn = pool.acquire()
+    assert conn not in (fresh, dead)
+    assert dead.closed and fresh.closed
+    assert pool._idle == []
@@ -0,0 +1,81 @@
+import csv
+import io
+from datetime import datetime
+
+import pytest
+
+from reflects import export
+
+COLUMNS = [("id", "int"), ("summary", "str"), ("submitted_at", "timestamp"), ("obsolete", "bool")]
+ROWS = [
+    (1, 'has, "quotes"', datetime(2024, 5, 1, 9, 30), False),
+    (2, None, datetime(2024, 5, 2, 10, 0), True),
+    (3, "third", datetime(2024, 5, 3, 11, 15), False),
+]
+
+def batches():
+    yield ROWS[:2]
+    yield ROWS[2:]
+
+
+class FakeNamedCursor:
+    def __init__(self, rows):
+        self.rows = list(rows)
+        self.closed = False
+
+    def execute(self, query, params=None):
+        self.params = params
+
+    def fetchmany(self, size):
+        batch, self.rows = self.rows[:size], self.rows[size:]
+        return batch
+
+    def close(self):
+        self.closed = True
+
+class FakeConnection:
+    def __init__(self, rows):
+        self.autocommit = True
+        self.closed = False
+        self.cur = FakeNamedCursor(rows)
+
+    def cursor(self, name=None):
+        self.cursor_name = name
+        return self.cur
+
+    def close(self):
+        self.closed = True
+
+
+def test_fetch_batches_uses_named_cursor_and_closes():
+    conn = FakeConnection(ROWS)
+    assert list(export.fetch_batches(conn, "SELECT 1", [7], batch_size=2)) == [ROWS[:2], ROWS[2:]]
+    assert conn.cursor_name.startswith("export_")
+    assert conn.autocommit is False
+    assert conn.cur.params == (7,)
+    assert conn.cur.closed and conn.closed
+
+def test_fetch_batches_closes_when_abandoned():
+    conn = FakeConnection(ROWS)
+    stream = export.fetch_batches(conn, "SELECT 1", [], batch_size=1)
+    next(stream)
+    stream.close()
+    assert conn.cur.closed and conn.closed
+
+def test_stream_csv_yields_one_chunk_per_batch():
+    chunks = list(export.stream_csv(batches(), COLUMNS, lambda r: r))
+    assert len(chunks) == 2
+    rows = list(csv.reader(io.StringIO(b"".join(chunks).decode("utf-8"))))
+    assert rows[0] == ["id", "summary", "submitted_at", "obsolete"]
+    assert rows[1] == ["1", 'has, "quotes"', "2024-05-01 09:30:00", "False"]
+    assert rows[2][1] == ""
+    assert len(rows) == 4
+
+def test_stream_parquet_writes_row_group_per_batch():
+    pq = pytest.importorskip("pyarrow.parquet")
+    data = b"".join(export.stream_parquet(batches(), COLUMNS, lambda r: r))
+    parquet = pq.ParquetFile(io.BytesIO(data))
+    assert parquet.num_row_groups == 2
+    table = parquet.read()
+    assert table.column_names == ["id", "summary", "submitted_at", "obsolete"]
+    assert table.column("summary").to_pylist() == ['has, "quotes"', None, "third"]
@@ -0,0 +1,114 @@
+import io
+
+import pytest
+
+from reflects import main, media
+from reflects.storage import LocalFileBackend
+
+
+class FakeCursor:
+    def __init__(self, executed):
+        self.executed = executed
+
+    def execute(self, query, params=None):
+        self.executed.append((" ".join(query.split()), params))
+
+    def close(self):
+        pass
+
+class FakeConnection:
+    def __init__(self):
+        self.executed = []
+        self.committed = False
+
+    def cursor(self):
+        return FakeCursor(self.executed)
+
+    def commit(self):
+        self.committed = True
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def storage(tmp_path, monkeypatch):
+    backend = LocalFileBackend(root=str(tmp_path / "store"), signing_key="test-key")
+    monkeypatch.setattr("reflects.storage._storage", backend)
+    return backend
+
+@pytest.fixture
+def ffmpeg_runs(monkeypatch):
+    """Stand-in for ffmpeg: writes a marker file to the output path."""
+    runs = []
+
+    def fake_ffmpeg(*args):
+        runs.append(args)
+        with open(args[-1], "wb") as f:
+            f.write(b"rendered")
+
+    monkeypatch.setattr(media, "_ffmpeg", fake_ffmpeg)
+    return runs
+
+@pytest.fixture
+def db(monkeypatch):
+    conn = FakeConnection()
+    monkeypatch.setattr(media, "get_db_connection", lambda: conn)
+    return conn
+
+
+def test_rendition_names():
+    assert media.rendition_names("videos/ab12") == ("videos/ab12_web.mp4", "videos/ab12_thumb.jpg")
+    assert media.rendition_names("7_3_clip.mov") == ("7_3_clip_web.mp4", "7_3_clip_thumb.jpg")
+
+def test_signed_media_prefers_web_rendition(monkeypatch):
+    monkeypatch.setattr(main, "get_sas_url", lambda key: f"signed:{key}")
+    assert main.signed_media("v", "v_web.mp4", "v_thumb.jpg") == (
+        "signed:v_web.mp4", "signed:v_thumb.jpg")
+    assert main.signed_media("v", "v_web.mp4", None, "original") == ("signed:v", None)
+
+def test_signed_media_falls_back_to_original(monkeypatch):
+    monkeypatch.setattr(main, "get_sas_url", lambda key: f"signed:{key}")
+    # Not transcoded yet
+    assert main.signed_media("v", None, None) == ("signed:v", None)
+
+def test_process_reflection_builds_and_records_renditions(storage, ffmpeg_runs, db):
+    storage.save(io.BytesIO(b"original"), "videos/ab12")
+
+    media.process_reflection(5, "videos/ab12")
+
+    assert len(ffmpeg_runs) == 2  # web rendition, then thumbnail from it
+    assert storage.exists("videos/ab12_web.mp4")
+    assert storage.exists("videos/ab12_thumb.jpg")
+    assert db.executed == [(
+        "UPDATE reflections SET web_video_url = %s, thumbnail_url = %s WHERE id = %s",
+        ("videos/ab12_web.mp4", "videos/ab12_thumb.jpg", 5),
+    )]
+    assert db.committed
+
+def test_process_reflection_reuses_existing_renditions(storage, ffmpeg_runs, db):
+    for key in ("videos/ab12", "videos/ab12_web.mp4", "videos/ab12_thumb.jpg"):
+        storage.save(io.BytesIO(b"x"), key)
+
+    media.process_reflection(6, "videos/ab12")
+
+    assert ffmpeg_runs == []
+    assert db.executed[0][1] == ("videos/ab12_web.mp4", "videos/ab12_thumb.jpg", 6)
+
+def test_pod_slots_bound_concurrent_jobs(tmp_path, monkeypatch):
+    import threading
+
+    monkeypatch.setattr(media, "MEDIA_LOCK_DIR", str(tmp_path))
+    monkeypatch.setattr(media, "MEDIA_SLOTS_PER_POD", 2)
+    entered = threading.Event()
+
+    def third_job():
+        with media._pod_slot():
+            entered.set()
+
+    with media._pod_slot(), media._pod_slot():
+        thread = threading.Thread(target=third_job)
+        thread.start()
+        assert not entered.wait(0.3)
+    assert entered.wait(2)
+    thread.join()
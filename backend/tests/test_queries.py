@@ -0,0 +1,172 @@
+from datetime import datetime
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from reflects import curriculum, main, queries
+from reflects.auth import get_current_user
+
+
+class RecordingCursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self.calls = []
+
+    def execute(self, query, params=None):
+        queries.count_round_trip()
+        self.calls.append((query, params))
+
+class PooledConn:
+    def __init__(self):
+        self.prepared = set()
+
+class PlainConn:
+    pass
+
+
+def test_execute_prepares_once_per_connection():
+    conn = PooledConn()
+    cur = RecordingCursor(conn)
+    queries.execute(cur, "user_profile", (1,))
+    queries.execute(cur, "user_profile", (2,))
+
+    assert cur.calls[0][0].startswith("PREPARE user_profile AS")
+    assert cur.calls[1:] == [
+        ("EXECUTE user_profile (%s)", (1,)),
+        ("EXECUTE user_profile (%s)", (2,)),
+    ]
+    assert conn.prepared == {"user_profile"}
+
+def test_execute_without_pool_runs_plain_sql():
+    cur = RecordingCursor(PlainConn())
+    queries.execute(cur, "user_profile", (7,))
+    assert cur.calls == [("SELECT name, email FROM users WHERE id = %s", (7,))]
+
+def test_middleware_reports_round_trips():
+    app = FastAPI()
+    app.add_middleware(queries.RoundTripMiddleware)
+
+    @app.get("/work")
+    def work():
+        cur = RecordingCursor(PooledConn())
+        queries.execute(cur, "active_chapters")
+        return {"seen": queries.round_trips()}
+
+    response = TestClient(app).get("/work")
+    assert response.json() == {"seen": 2}
+    assert response.headers["X-DB-Round-Trips"] == "2"
+    assert queries.round_trips() == 0
+
+
+# --- Routes, with the database stubbed out ---
+class RouteCursor(RecordingCursor):
+    def fetchone(self):
+        return self.connection.row
+
+    def fetchall(self):
+        return self.connection.rows
+
+    def close(self):
+        pass
+
+class RouteConn:
+    """A pooled connection that has already prepared every statement."""
+
+    def __init__(self, row=None, rows=()):
+        self.prepared = set(queries.STATEMENTS)
+        self.row = row
+        self.rows = list(rows)
+        self.cursors = []
+
+    def cursor(self):
+        self.cursors.append(RouteCursor(self))
+        return self.cursors[-1]
+
+    def commit(self):
+        queries.count_round_trip()
+
+    def rollback(self):
+        queries.count_round_trip()
+
+    def close(self):
+        pass
+
+    @property
+    def calls(self):
+        return [call for cur in self.cursors for call in cur.calls]
+
+
+@pytest.fixture
+def route_client(monkeypatch):
+    snapshot = curriculum.Snapshot.from_rows([
+        (1, "Maths", False, 10, "Algebra", False),
+        (1, "Maths", False, 11, "Geometry", False),
+    ])
+    monkeypatch.setattr(curriculum, "get_snapshot", lambda chapter_ids=(): snapshot)
+    monkeypatch.setattr(main, "mark_recent_write", lambda user_id: None)
+    monkeypatch.setattr(main, "purge_media", lambda keys: None)
+    monkeypatch.setattr(main, "get_sas_url", lambda key: f"signed:{key}")
+
+    def use(conn, role="teacher"):
+        main.app.dependency_overrides[get_current_user] = lambda: {"user_id": 1, "role": role}
+        monkeypatch.setattr(main, "get_db_connection", lambda: conn)
+        monkeypatch.setattr(main, "get_read_connection", lambda user_id=None: conn)
+        return TestClient(main.app)
+
+    yield use
+    main.app.dependency_overrides.pop(get_current_user, None)
+
+def test_delete_student_is_one_statement(route_client):
+    conn = RouteConn(row=(5, []))
+    response = route_client(conn).delete("/students/student@example.com")
+
+    assert response.status_code == 200
+    assert conn.calls == [("EXECUTE student_delete (%s)", ("student@example.com",))]
+    assert response.headers["X-DB-Round-Trips"] == "2"  # statement + COMMIT
+
+def test_create_subject_is_one_statement(route_client):
+    conn = RouteConn(row=(3, ""))
+    response = route_client(conn).post("/subjects", json={"name": "Physics"})
+
+    assert response.status_code == 200
+    assert conn.calls == [("EXECUTE subject_upsert (%s)", ("Physics",))]
+    assert response.headers["X-DB-Round-Trips"] == "2"  # upsert + NOTIFY, then COMMIT
+
+def test_all_reflections_by_subject_is_one_query(route_client):
+    conn = RouteConn(rows=[])
+    response = route_client(conn).get("/all-reflections", params={"subject_id": 1})
+
+    assert response.status_code == 200
+    [(sql, params)] = conn.calls
+    assert "chapters" not in sql and "subjects" not in sql
+    assert [10, 11] in params
+    assert response.headers["X-DB-Round-Trips"] == "1"
+
+def test_search_is_one_ranked_query(route_client):
+    conn = RouteConn(rows=[(
+        4, "student@example.com", 10, "videos/ab", "Photosynthesis notes", datetime(2026, 1, 5),
+        "understood", "Good", False, "videos/ab_web.mp4", "videos/ab_thumb.jpg", 0.5,
+    )])
+    response = route_client(conn).get("/reflections/search", params={
+        "q": "photosynthesis", "email": "student@example.com", "subject_id": 1,
+        "limit": 5, "offset": 10,
+    })
+
+    assert response.status_code == 200
+    [(sql, params)] = conn.calls
+    # The tsquery placeholder comes first (CROSS JOIN), then the filters, then paging
+    assert params == ("photosynthesis", "student@example.com", [10, 11], 5, 10)
+    assert sql.index("websearch_to_tsquery('english', %s)") < sql.index("r.obsolete = FALSE")
+    assert "AND u.email = %s AND r.chapter_id = ANY(%s)" in sql
+    assert sql.endswith("ORDER BY rank DESC, r.submitted_at DESC LIMIT %s OFFSET %s")
+    assert response.headers["X-DB-Round-Trips"] == "1"
+    [hit] = response.json()
+    assert (hit["rank"], hit["chapter_name"], hit["subject_name"]) == (0.5, "Algebra", "Maths")
+    assert hit["video_url"] == "signed:videos/ab_web.mp4"
+
+def test_search_is_for_teachers_only(route_client):
+    conn = RouteConn()
+    response = route_client(conn, role="student").get("/reflections/search", params={"q": "x"})
+    assert response.status_code == 403
+    assert conn.calls == []
@@ -0,0 +1,25 @@
+from reflects import server
+
+
+def test_available_cpus_honours_cgroup_v2_quota(tmp_path, monkeypatch):
+    monkeypatch.setattr(server.os, "sched_getaffinity", lambda pid: set(range(8)))
+    (tmp_path / "cpu.max").write_text("250000 100000\n")
+    assert server.available_cpus(str(tmp_path)) == 2.5
+
+def test_available_cpus_without_limit(tmp_path, monkeypatch):
+    monkeypatch.setattr(server.os, "sched_getaffinity", lambda pid: set(range(4)))
+    (tmp_path / "cpu.max").write_text("max 100000\n")
+    assert server.available_cpus(str(tmp_path)) == 4
+
+def test_worker_count(monkeypatch):
+    monkeypatch.delenv("WEB_CONCURRENCY", raising=False)
+    monkeypatch.setattr(server, "available_cpus", lambda: 2.5)
+    assert server.worker_count() == 3
+    monkeypatch.setenv("WEB_CONCURRENCY", "5")
+    assert server.worker_count() == 5
+
+def test_server_options_preload_and_drain():
+    options = server.server_options()
+    assert options["preload_app"] is True
+    assert options["worker_class"] is server.ReflectsWorker
+    assert options["graceful_timeout"] == server.GRACEFUL_TIMEOUT
@@ -0,0 +1,102 @@
+import asyncio
+import multiprocessing
+
+import httpx
+
+from reflects import shedding
+
+
+def group(name="test", concurrency=1, queue=1, queue_timeout=0.5, retry_after=3, metrics=None):
+    return shedding.RouteGroup(name, concurrency, queue, queue_timeout, retry_after, metrics)
+
+
+def test_route_groups():
+    assert shedding.route_group("POST", "/login") == "login"
+    assert shedding.route_group("POST", "/submit-reflection") == "upload"
+    assert shedding.route_group("GET", "/submit-reflection/jobs/abc") == "default"
+    assert shedding.route_group("GET", "/all-reflections") == "reports"
+    assert shedding.route_group("GET", "/reflections/export") == "reports"
+    assert shedding.route_group("GET", "/media/videos/a.mp4") == "media"
+    assert shedding.route_group("GET", "/subjects") == "default"
+    assert shedding.route_group("GET", "/healthz") is None
+
+def test_release_hands_slot_to_waiter():
+    async def run():
+        g = group(queue_timeout=5)
+        assert await g.acquire() is None
+        waiter = asyncio.ensure_future(g.acquire())
+        await asyncio.sleep(0)
+        assert g.queued == 1
+        g.release()
+        assert await waiter is None
+        assert (g.active, g.queued, g.admitted) == (1, 0, 2)
+        g.release()
+        assert g.active == 0
+    asyncio.run(run())
+
+def test_sheds_when_queue_full_or_wait_times_out():
+    async def run():
+        g = group(queue_timeout=0.05)
+        await g.acquire()
+        waiter = asyncio.ensure_future(g.acquire())
+        await asyncio.sleep(0)
+        assert await g.acquire() == "queue_full"
+        assert await waiter == "timeout"
+        assert g.shed == {"queue_full": 1, "timeout": 1}
+        assert (g.active, g.queued) == (1, 0)
+    asyncio.run(run())
+
+def test_middleware_returns_503_with_retry_after():
+    gate = asyncio.Event()
+
+    async def slow_app(scope, receive, send):
+        await gate.wait()
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"ok"})
+
+    groups = {name: group(name, queue=0) for name in shedding.DEFAULT_LIMITS}
+    app = shedding.LoadSheddingMiddleware(slow_app, groups)
+
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            first = asyncio.ensure_future(client.get("/all-reflections"))
+            await asyncio.sleep(0.05)
+            shed = await client.get("/all-reflections")
+            gate.set()
+            return await first, shed
+
+    first, shed = asyncio.run(run())
+    assert first.status_code == 200
+    assert shed.status_code == 503
+    assert shed.headers["Retry-After"] == "3"
+    assert groups["reports"].active == 0
+
+    text = shedding.render_metrics(groups)
+    assert 'reflects_route_group_shed_total{group="reports",reason="queue_full"} 1' in text
+    assert 'reflects_route_group_admitted_total{group="reports"} 1' in text
+
+def test_metrics_add_up_all_workers(tmp_path, monkeypatch):
+    metrics = shedding.WorkerMetrics(["test"], str(tmp_path))
+    g = group(metrics=metrics)
+    asyncio.run(g.acquire())
+
+    def other_worker():
+        busy = group(metrics=metrics)
+        asyncio.run(busy.acquire())
+        assert asyncio.run(busy.acquire()) == "timeout"
+
+    # A forked worker writes its own file; once it has exited only its counters count
+    worker = multiprocessing.get_context("fork").Process(target=other_worker)
+    worker.start()
+    worker.join()
+    assert worker.exitcode == 0
+    assert len(list(tmp_path.iterdir())) == 2
+
+    monkeypatch.setattr(shedding, "_worker_metrics", metrics)
+    monkeypatch.setattr(shedding, "_groups", {"test": g})
+    text = shedding.render_metrics()
+    assert 'reflects_route_group_admitted_total{group="test"} 2' in text
+    assert 'reflects_route_group_shed_total{group="test",reason="timeout"} 1' in text
+    assert 'reflects_route_group_queue_wait_seconds_count{group="test"} 1' in text
+    assert 'reflects_route_group_in_flight{group="test"} 1' in text
@@ -0,0 +1,49 @@
+import json
+import os
+import subprocess
+import sys
+
+# Budgets are generous so CI noise doesn't flake; the printed timings are the trend to watch
+IMPORT_BUDGET = float(os.getenv("STARTUP_IMPORT_BUDGET", 1.5))
+HEALTHZ_BUDGET = float(os.getenv("STARTUP_HEALTHZ_BUDGET", 3.0))
+
+# Modules that must only be imported by the code paths that use them
+LAZY_MODULES = ["azure.storage.blob", "jose", "passlib", "redis", "boto3"]
+
+SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import reflects.main
+imported = time.perf_counter()
+from fastapi.testclient import TestClient
+with TestClient(reflects.main.app) as client:
+    status = client.get("/healthz").status_code
+healthy = time.perf_counter()
+print(json.dumps({
+    "import_s": imported - start,
+    "healthz_s": healthy - start,
+    "status": status,
+    "loaded": [m for m in %r if m in sys.modules],
+}))
+""" % (LAZY_MODULES,)
+
+
+def measure_startup() -> dict:
+    # Run in a fresh interpreter without Redis settings: startup must not need them
+    env = {k: v for k, v in os.environ.items() if not k.startswith("REDIS_")}
+    backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env["PYTHONPATH"] = backend_dir + os.pathsep + env.get("PYTHONPATH", "")
+    out = subprocess.run(
+        [sys.executable, "-c", SCRIPT], env=env, cwd=backend_dir,
+        capture_output=True, text=True, check=True, timeout=60,
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+def test_startup_time_and_lazy_imports():
+    result = measure_startup()
+    print(f"import reflects.main: {result['import_s']:.3f}s, "
+          f"first healthy /healthz: {result['healthz_s']:.3f}s")
+    assert result["status"] == 200
+    assert result["loaded"] == []
+    assert result["import_s"] < IMPORT_BUDGET
+    assert result["healthz_s"] < HEALTHZ_BUDGET
@@ -0,0 +1,203 @@
+import io
+import time
+
+import pytest
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.routing import Route
+from fastapi.testclient import TestClient
+
+from reflects.storage import (
+    LocalFileBackend, content_key, discard_unreferenced, video_content_type,
+)
+from reflects.streaming import RangeFileResponse, parse_range
+
+
+@pytest.fixture
+def storage(tmp_path):
+    return LocalFileBackend(root=str(tmp_path), url_prefix="/media", signing_key="test-key")
+
+def test_local_save_and_fetch(storage, tmp_path):
+    storage.save(io.BytesIO(b"video-bytes"), "1_2_clip.mp4")
+    assert storage.exists("1_2_clip.mp4")
+    dest = tmp_path / "copy.mp4"
+    storage.fetch("1_2_clip.mp4", str(dest))
+    assert dest.read_bytes() == b"video-bytes"
+    storage.delete("1_2_clip.mp4")
+    assert not storage.exists("1_2_clip.mp4")
+
+def test_local_rejects_path_traversal(storage):
+    with pytest.raises(ValueError):
+        storage.path("../secrets.env")
+
+def test_signed_url_round_trip(storage):
+    url = storage.url("1_2_clip.mp4", expires_in=60)
+    query = dict(part.split("=") for part in url.split("?")[1].split("&"))
+    assert storage.verify("1_2_clip.mp4", int(query["expires"]), query["sig"])
+    assert not storage.verify("other.mp4", int(query["expires"]), query["sig"])
+    assert not storage.verify("1_2_clip.mp4", int(time.time()) - 1, query["sig"])
+
+def test_parse_range():
+    assert parse_range(None, 100) is None
+    assert parse_range("bytes=0-9", 100) == (0, 9)
+    assert parse_range("bytes=90-", 100) == (90, 99)
+    assert parse_range("bytes=-10", 100) == (90, 99)
+    assert parse_range("bytes=50-500", 100) == (50, 99)
+    assert parse_range("bytes=0-1,5-6", 100) is None
+    with pytest.raises(ValueError):
+        parse_range("bytes=100-", 100)
+
+
+@pytest.fixture
+def range_client(tmp_path):
+    path = tmp_path / "clip.mp4"
+    path.write_bytes(bytes(range(256)) * 4)
+
+    def serve(request: Request):
+        return RangeFileResponse(str(path), range_header=request.headers.get("range"))
+
+    return TestClient(Starlette(routes=[Route("/clip", serve, methods=["GET", "HEAD"])]))
+
+def test_range_response_full(range_client):
+    response = range_client.get("/clip")
+    assert response.status_code == 200
+    assert response.headers["accept-ranges"] == "bytes"
+    assert len(response.content) == 1024
+
+def test_range_response_partial(range_client):
+    response = range_client.get("/clip", headers={"Range": "bytes=10-19"})
+    assert response.status_code == 206
+    assert response.headers["content-range"] == "bytes 10-19/1024"
+    assert response.content == bytes(range(10, 20))
+
+def test_range_response_unsatisfiable(range_client):
+    response = range_client.get("/clip", headers={"Range": "bytes=2000-"})
+    assert response.status_code == 416
+    assert response.headers["content-range"] == "bytes */1024"
+
+class TypeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def execute(self, query, params=None):
+        self.connection.lookups.append(params[0])
+
+    def fetchone(self):
+        return ("video/quicktime",)
+
+    def close(self):
+        pass
+
+class TypeConn:
+    def __init__(self):
+        self.lookups = []
+
+    def cursor(self):
+        return TypeCursor(self)
+
+    def close(self):
+        pass
+
+def test_media_route_sends_recorded_content_type(storage, monkeypatch):
+    from reflects import main
+
+    monkeypatch.setattr("reflects.storage._storage", storage)
+    monkeypatch.setattr(main, "_media_types", {})
+    conn = TypeConn()
+    monkeypatch.setattr(main, "get_read_connection", lambda user_id=None: conn)
+    storage.save(io.BytesIO(b"mov"), "videos/abc")
+    storage.save(io.BytesIO(b"jpg"), "videos/abc_thumb.jpg")
+    client = TestClient(main.app)
+
+    for _ in range(2):
+        response = client.get(storage.url("videos/abc"), headers={"Range": "bytes=0-1"})
+        assert response.headers["content-type"] == "video/quicktime"
+    assert conn.lookups == ["videos/abc"]  # cached after the first request
+    thumb = client.get(storage.url("videos/abc_thumb.jpg"))
+    assert thumb.headers["content-type"] == "image/jpeg"
+    assert conn.lookups == ["videos/abc"]
+
+def test_content_key_is_hash_based():
+    assert content_key("ab12") == "videos/ab12"
+
+def test_video_content_type():
+    assert video_content_type("video/mp4") == "video/mp4"
+    assert video_content_type("Video/QuickTime; codecs=avc1") == "video/quicktime"
+    assert video_content_type("text/html") is None
+    assert video_content_type(None) is None
+
+class MediaCursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self.row = None
+
+    def execute(self, query, params=None):
+        if "pg_advisory_xact_lock" in query:
+            self.connection.calls.append("lock")
+        elif "FROM media_objects" in query:
+            self.connection.calls.append("check")
+            self.row = (1,) if params[0] in self.connection.referenced else None
+
+    def fetchone(self):
+        return self.row
+
+    def close(self):
+        pass
+
+class MediaConn:
+    """Has media_objects rows for the keys in referenced."""
+
+    def __init__(self, referenced=()):
+        self.referenced = set(referenced)
+        self.calls = []
+
+    def cursor(self):
+        return MediaCursor(self)
+
+    def commit(self):
+        self.calls.append("COMMIT")
+
+    def close(self):
+        pass
+
+def test_purge_keeps_renditions_of_other_objects(storage, monkeypatch):
+    monkeypatch.setattr("reflects.storage._storage", storage)
+    from reflects import media
+
+    key, other = content_key("aa11"), content_key("bb22")
+    for name in (key, other, *media.rendition_names(key), *media.rendition_names(other)):
+        storage.save(io.BytesIO(b"stored"), name)
+    assert set(media.rendition_names(key)).isdisjoint(media.rendition_names(other))
+
+    # other was referenced again by an upload after its release committed
+    conn = MediaConn(referenced={other})
+    monkeypatch.setattr(media, "get_db_connection", lambda: conn)
+    media.purge_media([key, other])
+
+    assert not storage.exists(key)
+    assert not any(storage.exists(name) for name in media.rendition_names(key))
+    assert storage.exists(other)
+    assert all(storage.exists(name) for name in media.rendition_names(other))
+    # Each key is checked under its lock, released by a commit before the next
+    assert conn.calls == ["lock", "check", "COMMIT"] * 2
+
+def test_discard_unreferenced(storage, monkeypatch):
+    monkeypatch.setattr("reflects.storage._storage", storage)
+    storage.save(io.BytesIO(b"video"), "videos/abc")
+    assert not discard_unreferenced(MediaConn(referenced={"videos/abc"}).cursor(), "videos/abc")
+    assert storage.exists("videos/abc")
+    assert discard_unreferenced(MediaConn().cursor(), "videos/abc")
+    assert not storage.exists("videos/abc")
+
+def test_signing_key_required_in_production(tmp_path, monkeypatch):
+    monkeypatch.setattr("reflects.storage.MEDIA_SIGNING_KEY", None)
+    monkeypatch.setattr("reflects.storage.ENV", "production")
+    with pytest.raises(RuntimeError):
+        LocalFileBackend(root=str(tmp_path))
+
+    monkeypatch.setattr("reflects.storage.ENV", "local")
+    monkeypatch.setenv("JWT_SECRET", "jwt-secret")
+    backend = LocalFileBackend(root=str(tmp_path))
+    # Development falls back to a random key, never to JWT_SECRET or a fixed default
+    assert backend.signing_key not in (b"jwt-secret", b"avyaysecret")
+    assert len(backend.signing_key) == 64
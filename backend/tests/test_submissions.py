@@ -0,0 +1,261 @@
+import io
+
+import pytest
+
+from reflects import submissions
+
+
+class FakeRedis:
+    """Just enough of redis-py for the submission queue."""
+
+    def __init__(self):
+        self.data = {}
+
+    def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.data:
+            return None
+        self.data[key] = str(value)
+        return True
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+    def hset(self, key, mapping):
+        self.data.setdefault(key, {}).update({k: str(v) for k, v in mapping.items()})
+
+    def hgetall(self, key):
+        return dict(self.data.get(key, {}))
+
+    def expire(self, key, ttl):
+        pass
+
+    def lpush(self, key, value):
+        self.data.setdefault(key, []).insert(0, value)
+
+    def rpop(self, key):
+        queue = self.data.get(key) or []
+        return queue.pop() if queue else None
+
+    def eval(self, script, numkeys, key, expected, new, ttl):
+        # submissions._SWAP_MARKER
+        if self.data.get(key) != expected:
+            return 0
+        if new == "":
+            self.data.pop(key, None)
+        else:
+            self.data[key] = new
+        return 1
+
+
+@pytest.fixture
+def fake_redis(monkeypatch, tmp_path):
+    r = FakeRedis()
+    monkeypatch.setattr(submissions, "get_redis", lambda: r)
+    monkeypatch.setattr(submissions, "SPOOL_DIR", str(tmp_path))
+    monkeypatch.setattr(submissions, "start_workers", lambda: None)
+    return r
+
+def test_duplicate_submission_returns_same_job(fake_redis):
+    first = submissions.enqueue_submission(7, 3, "summary", io.BytesIO(b"video"))
+    second = submissions.enqueue_submission(7, 3, "summary", io.BytesIO(b"video"))
+    assert first == second
+    assert fake_redis.data[submissions.QUEUE_KEY] == [first]
+    assert submissions.job_status(first)["status"] == "queued"
+
+def test_job_runs_insert_and_cleans_spool(fake_redis, monkeypatch):
+    calls = []
+
+    def create_reflection(user_id, chapter_id, text_summary, fileobj, content_type):
+        calls.append((user_id, chapter_id, text_summary, fileobj.read(), content_type))
+        return 99
+
+    monkeypatch.setattr(submissions, "create_reflection", create_reflection)
+    job_id = submissions.enqueue_submission(7, 3, "summary", io.BytesIO(b"video"), "video/webm")
+    spool_path = submissions.get_job(job_id)["spool_path"]
+
+    submissions.process_job(fake_redis.rpop(submissions.QUEUE_KEY))
+
+    assert calls == [(7, 3, "summary", b"video", "video/webm")]
+    status = submissions.job_status(job_id)
+    assert status["status"] == "done"
+    assert status["reflection_id"] == 99
+    assert not (submissions.os.path.exists(spool_path))
+
+def test_failed_job_allows_resubmission(fake_redis, monkeypatch):
+    def create_reflection(*args):
+        raise RuntimeError("storage down")
+
+    monkeypatch.setattr(submissions, "create_reflection", create_reflection)
+    job_id = submissions.enqueue_submission(7, 3, None, io.BytesIO(b"video"))
+    submissions.process_job(fake_redis.rpop(submissions.QUEUE_KEY))
+
+    assert submissions.job_status(job_id)["status"] == "failed"
+    assert submissions.enqueue_submission(7, 3, None, io.BytesIO(b"video")) != job_id
+
+class InsertCursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self.row = None
+
+    def execute(self, query, params=None):
+        if "INSERT INTO reflections" in query:
+            self.row = self.connection.reflection_row
+        elif "INSERT INTO media_objects" in query:
+            self.connection.events.append(("acquire", params[2]))
+            self.row = (self.connection.new_object,)
+
+    def fetchone(self):
+        return self.row
+
+    def close(self):
+        pass
+
+class InsertConn:
+    def __init__(self, events):
+        self.events = events
+        self.reflection_row = (42,)
+        self.new_object = True
+        self.fail_commit = False
+
+    def cursor(self):
+        return InsertCursor(self)
+
+    def commit(self):
+        if self.fail_commit:
+            raise RuntimeError("connection lost")
+        self.events.append("commit")
+
+    def rollback(self):
+        self.events.append("rollback")
+
+    def close(self):
+        pass
+
+@pytest.fixture
+def store(monkeypatch):
+    """Stub storage + DB for create_reflection; records uploads, commits and discards."""
+    events = []
+    conn = InsertConn(events)
+    monkeypatch.setattr(submissions, "get_db_connection", lambda: conn)
+    monkeypatch.setattr(submissions, "save_object",
+                        lambda f, key, content_type: events.append(("upload", key, content_type)))
+    monkeypatch.setattr(submissions, "_discard_upload", lambda key: events.append(("discard", key)))
+    monkeypatch.setattr(submissions, "mark_recent_write", lambda user_id: None)
+    monkeypatch.setattr(submissions, "enqueue_transcode", lambda *args: None)
+    key = submissions.content_key(submissions.hash_file(io.BytesIO(b"video"))[0])
+    return conn, events, key
+
+def test_new_object_is_uploaded_before_commit(store):
+    conn, events, key = store
+    assert submissions.create_reflection(7, 3, None, io.BytesIO(b"video"), "video/mp4") == 42
+    assert events == [("acquire", "video/mp4"), ("upload", key, "video/mp4"), "commit"]
+
+def test_only_video_content_types_are_recorded(store):
+    conn, events, key = store
+    submissions.create_reflection(7, 3, None, io.BytesIO(b"video"), "text/html")
+    assert events == [("acquire", None), ("upload", key, None), "commit"]
+
+def test_referenced_object_is_not_uploaded(store):
+    conn, events, key = store
+    conn.new_object = False
+    assert submissions.create_reflection(7, 3, None, io.BytesIO(b"video")) == 42
+    assert events == [("acquire", None), "commit"]
+
+def test_duplicate_reflection_uploads_nothing(store):
+    conn, events, key = store
+    conn.reflection_row = None
+    assert submissions.create_reflection(7, 3, None, io.BytesIO(b"video")) is None
+    assert events == ["rollback"]
+
+def test_failed_commit_discards_new_upload(store):
+    conn, events, key = store
+    conn.fail_commit = True
+    with pytest.raises(RuntimeError):
+        submissions.create_reflection(7, 3, None, io.BytesIO(b"video"))
+    # The rollback releases the object lock before the discard takes it
+    assert events == [("acquire", None), ("upload", key, None), "rollback", ("discard", key)]
+
+def test_marker_always_names_a_job_record(fake_redis):
+    class CheckingUpload(io.BytesIO):
+        """Runs a duplicate submission while the first upload is being spooled."""
+
+        def read(self, *args):
+            if not hasattr(self, "duplicate"):
+                self.duplicate = submissions.enqueue_submission(7, 3, None, io.BytesIO(b"dup"))
+            return super().read(*args)
+
+    upload = CheckingUpload(b"video")
+    first = submissions.enqueue_submission(7, 3, None, upload)
+    assert upload.duplicate == first
+    assert fake_redis.data[submissions.QUEUE_KEY] == [first]
+
+def test_interrupted_upload_releases_marker(fake_redis):
+    class BrokenUpload(io.BytesIO):
+        def read(self, *args):
+            raise ConnectionResetError
+
+    with pytest.raises(ConnectionResetError):
+        submissions.enqueue_submission(7, 3, None, BrokenUpload())
+    assert submissions._dedupe_key(7, 3) not in fake_redis.data
+    assert submissions.enqueue_submission(7, 3, None, io.BytesIO(b"video"))
+
+def test_abandoned_job_is_replaced(fake_redis, monkeypatch):
+    first = submissions.enqueue_submission(7, 3, None, io.BytesIO(b"video"))
+    # Its pod died: nothing touches the job any more
+    now = submissions.time.time()
+    monkeypatch.setattr(submissions.time, "time", lambda: now + submissions.JOB_STALE_AFTER + 1)
+
+    second = submissions.enqueue_submission(7, 3, None, io.BytesIO(b"video"))
+    assert second != first
+    assert submissions.job_status(first)["status"] == "failed"
+    assert submissions.job_status(second)["status"] == "queued"
+    # A retry right away still dedupes onto the new job
+    assert submissions.enqueue_submission(7, 3, None, io.BytesIO(b"video")) == second
+
+def test_replaced_job_is_not_processed(fake_redis, monkeypatch):
+    calls = []
+    monkeypatch.setattr(submissions, "create_reflection", lambda *args: calls.append(args))
+    job_id = submissions.enqueue_submission(7, 3, None, io.BytesIO(b"video"))
+    submissions._set_status(job_id, status="failed")
+    submissions.process_job(job_id)
+    assert calls == []
+
+def test_redis_failure_is_queue_unavailable(fake_redis, monkeypatch, tmp_path):
+    from redis.exceptions import ConnectionError
+
+    def lpush(key, value):
+        raise ConnectionError("redis down")
+
+    monkeypatch.setattr(fake_redis, "lpush", lpush)
+    with pytest.raises(submissions.QueueUnavailable):
+        submissions.enqueue_submission(7, 3, None, io.BytesIO(b"video"))
+
+    # Spool gone and marker freed, so the retry is a fresh submission
+    assert list(tmp_path.iterdir()) == []
+    assert submissions._dedupe_key(7, 3) not in fake_redis.data
+
+def test_unavailable_queue_answers_503(monkeypatch):
+    from fastapi.testclient import TestClient
+
+    from reflects import main
+    from reflects.auth import get_current_user
+
+    def enqueue_submission(*args):
+        raise submissions.QueueUnavailable("Could not queue the submission, please try again.")
+
+    monkeypatch.setattr(main, "enqueue_submission", enqueue_submission)
+    monkeypatch.setattr(main, "hybrid_rate_limiter", lambda *args: True)
+    main.app.dependency_overrides[get_current_user] = lambda: {"user_id": 7, "role": "student"}
+    try:
+        response = TestClient(main.app).post(
+            "/submit-reflection?mode=async", data={"chapter_id": "3"},
+            files={"video_file": ("clip.mp4", b"video", "video/mp4")},
+        )
+    finally:
+        main.app.dependency_overrides.pop(get_current_user, None)
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == str(submissions.QUEUE_RETRY_AFTER)